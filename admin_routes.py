@@ -1,6 +1,6 @@
 from flask import Blueprint, jsonify, request
 from extensions import db
-from models import User, Conversation, Message
+from models import User, Conversation
 from sqlalchemy import func
 from datetime import datetime, timedelta
 
@@ -18,29 +18,111 @@ def get_stats():
     # if not check_admin(userId):
     #     return jsonify({"error": "Unauthorized"}), 403
 
-    total_users = User.query.count()
-    total_conversations = Conversation.query.count()
-    
-    # Active users in last 24h (based on message activity)
-    yesterday = datetime.utcnow() - timedelta(days=1)
-    active_users_count = db.session.query(Conversation.user_id).join(Message).filter(Message.created_at >= yesterday).distinct().count()
+    # Counters and hourly buckets maintained on the write paths, no table scans here
+    from services.stats import get_dashboard_stats
+    return jsonify(get_dashboard_stats())
 
-    # Cases by type/status
-    risk_cases = Conversation.query.filter_by(status='risk_detected').count()
-    
-    return jsonify({
-        "totalUsers": total_users,
-        "totalConversations": total_conversations,
-        "activeUsers24h": active_users_count,
-        "riskCases": risk_cases
-    })
+@admin_bp.route('/stats/reconcile', methods=['POST'])
+def reconcile_stats():
+    from services.stats import reconcile
+    drift = reconcile()
+    return jsonify({"message": "Stats reconciled", "drift": drift})
+
+ADMIN_PAGE_SIZE = 50
+ADMIN_PAGE_SIZE_MAX = 500
+
+def parse_paging(args):
+    """page (1-based) and pageSize from the query string. Raises ValueError on bad values."""
+    page = int(args.get('page', 1))
+    page_size = int(args.get('pageSize', ADMIN_PAGE_SIZE))
+    if page < 1 or page_size < 1:
+        raise ValueError("page and pageSize must be positive")
+    return page, min(page_size, ADMIN_PAGE_SIZE_MAX)
+
+def parse_date(value, end_of_day=False):
+    """ISO date or datetime; a bare `to` date includes that whole day."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def parse_bool(value):
+    if value is None:
+        return None
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"Invalid boolean: {value}")
+
+def apply_sort(query, args, sort_columns, default, id_column):
+    sort = args.get('sort', default)
+    if sort not in sort_columns:
+        raise ValueError(f"Invalid sort: {sort}")
+    order = args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        raise ValueError(f"Invalid order: {order}")
+    column = sort_columns[sort]
+    # id as tie-breaker keeps pages stable when the sort column has duplicates
+    if order == 'asc':
+        return query.order_by(column.asc(), id_column.asc())
+    return query.order_by(column.desc(), id_column.desc())
+
+def paginate(query, count_query, filters, page, page_size):
+    """(rows, total): two statements whatever the page or table size.
+
+    The total is counted on the filtered base table alone, without the joins and aggregates of the page query.
+    """
+    total = count_query.filter(*filters).scalar()
+    rows = query.filter(*filters).limit(page_size).offset((page - 1) * page_size).all()
+    return rows, total
 
 @admin_bp.route('/users', methods=['GET'])
 def get_users():
-    users = User.query.all()
+    # ?page=&pageSize=&sort=joinedAt|email|name|conversationCount&order=asc|desc
+    # &approved=true|false&role=client|admin&joinedFrom=YYYY-MM-DD&joinedTo=YYYY-MM-DD
+    conv_counts = db.session.query(
+        Conversation.user_id.label('user_id'), func.count(Conversation.id).label('conversation_count')
+    ).group_by(Conversation.user_id).subquery()
+    conversation_count = func.coalesce(conv_counts.c.conversation_count, 0)
+
+    query = db.session.query(
+        User.id, User.email, User.full_name, User.role, User.is_admin, User.is_approved, User.created_at,
+        conversation_count.label('conversation_count')
+    ).outerjoin(conv_counts, conv_counts.c.user_id == User.id)
+
+    try:
+        page, page_size = parse_paging(request.args)
+        approved = parse_bool(request.args.get('approved'))
+        role = request.args.get('role')
+        if role and role not in ('client', 'admin'):
+            raise ValueError(f"Invalid role: {role}")
+        joined_from = parse_date(request.args.get('joinedFrom'))
+        joined_to = parse_date(request.args.get('joinedTo'), end_of_day=True)
+        query = apply_sort(query, request.args, {
+            "joinedAt": User.created_at,
+            "email": User.email,
+            "name": User.full_name,
+            "conversationCount": conversation_count,
+        }, 'joinedAt', User.id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filters = []
+    if approved is not None:
+        filters.append(User.is_approved == approved)
+    if role:
+        filters.append(User.role == role)
+    if joined_from:
+        filters.append(User.created_at >= joined_from)
+    if joined_to:
+        filters.append(User.created_at < joined_to)
+
+    users, total = paginate(query, db.session.query(func.count(User.id)), filters, page, page_size)
     user_list = []
     for u in users:
-        conv_count = Conversation.query.filter_by(user_id=u.id).count()
         user_list.append({
             "id": u.id,
             "email": u.email,
@@ -48,10 +130,10 @@ def get_users():
             "role": u.role,
             "isAdmin": u.is_admin,
             "isApproved": u.is_approved,
-            "joinedAt": u.created_at.isoformat(),
-            "conversationCount": conv_count
+            "joinedAt": u.created_at.isoformat() if u.created_at else None,
+            "conversationCount": u.conversation_count
         })
-    return jsonify({"users": user_list})
+    return jsonify({"users": user_list, "total": total, "page": page, "pageSize": page_size})
 
 @admin_bp.route('/users', methods=['POST'])
 def create_user():
@@ -78,7 +160,9 @@ def create_user():
         is_admin=is_admin,
         is_approved=is_approved
     )
+    from services import stats
     db.session.add(new_user)
+    stats.increment(stats.USERS)
     db.session.commit()
     
     return jsonify({"message": "User created", "id": new_user.id}), 201
@@ -107,25 +191,62 @@ def delete_user(id):
     if not user:
         return jsonify({"error": "User not found"}), 404
         
+    from services import stats
     db.session.delete(user)
+    stats.increment(stats.USERS, -1)
     db.session.commit()
     return jsonify({"message": "User deleted"})
 
 @admin_bp.route('/conversations', methods=['GET'])
 def get_recent_conversations():
-    # Get recent 50 conversations
-    convs = Conversation.query.order_by(Conversation.updated_at.desc()).limit(50).all()
+    # Most recent activity first by default; from/to filter on the last message time
+    # ?page=&pageSize=&sort=lastMessageAt|updatedAt|createdAt|messageCount&order=asc|desc&status=&userId=&from=&to=
+    query = db.session.query(
+        Conversation.id, Conversation.title, Conversation.status, Conversation.updated_at, Conversation.last_message_at,
+        Conversation.message_count, Conversation.last_message_preview, User.email.label('user_email')
+    ).outerjoin(User, User.id == Conversation.user_id)
+
+    try:
+        page, page_size = parse_paging(request.args)
+        status = request.args.get('status')
+        if status and status not in ('active', 'archived', 'risk_detected'):
+            raise ValueError(f"Invalid status: {status}")
+        user_id = int(request.args['userId']) if request.args.get('userId') else None
+        date_from = parse_date(request.args.get('from'))
+        date_to = parse_date(request.args.get('to'), end_of_day=True)
+        query = apply_sort(query, request.args, {
+            "lastMessageAt": Conversation.last_message_at,
+            "updatedAt": Conversation.updated_at,
+            "createdAt": Conversation.created_at,
+            "messageCount": Conversation.message_count,
+        }, 'lastMessageAt', Conversation.id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filters = []
+    if status:
+        filters.append(Conversation.status == status)
+    if user_id:
+        filters.append(Conversation.user_id == user_id)
+    if date_from:
+        filters.append(Conversation.last_message_at >= date_from)
+    if date_to:
+        filters.append(Conversation.last_message_at < date_to)
+
+    convs, total = paginate(query, db.session.query(func.count(Conversation.id)), filters, page, page_size)
     result = []
     for c in convs:
-        user = User.query.get(c.user_id) if c.user_id else None
         result.append({
             "id": c.id,
             "title": c.title,
             "status": c.status,
             "updatedAt": c.updated_at.isoformat(),
-            "userEmail": user.email if user else "Anonymous"
+            "lastMessageAt": c.last_message_at.isoformat() if c.last_message_at else None,
+            "messageCount": c.message_count,
+            "lastMessagePreview": c.last_message_preview,
+            "userEmail": c.user_email or "Anonymous"
         })
-    return jsonify({"conversations": result})
+    return jsonify({"conversations": result, "total": total, "page": page, "pageSize": page_size})
 
 @admin_bp.route('/knowledge', methods=['POST'])
 def upload_knowledge():
@@ -135,44 +256,66 @@ def upload_knowledge():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
-    if not file.filename.lower().endswith('.pdf'):
-        return jsonify({"error": "Only PDF files are supported currently"}), 400
+    from services.extraction import SUPPORTED_EXTENSIONS, file_extension
+    if file_extension(file.filename) not in SUPPORTED_EXTENSIONS:
+        return jsonify({"error": f"Unsupported file type. Use: {', '.join(sorted(SUPPORTED_EXTENSIONS))}"}), 400
 
     try:
-        import PyPDF2
-        pdf_reader = PyPDF2.PdfReader(file)
-        text_content = ""
-        for page in pdf_reader.pages:
-            text_content += page.extract_text() + "\n"
-        
-        # Save to DB
-        from models import KnowledgeBase
-        kb_item = KnowledgeBase(
-            title=file.filename,
-            content=text_content,
-            file_type='pdf'
-        )
-        db.session.add(kb_item)
+        import os
+        import uuid
+        from flask import current_app
+        from werkzeug.utils import secure_filename
+        from models import IngestionJob
+        from services.ingestion import submit_job
+
+        # Store the upload and let a background job parse and index it
+        stored_name = f"kb_{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], stored_name)
+        file.save(file_path)
+
+        job = IngestionJob(filename=file.filename, file_path=file_path)
+        db.session.add(job)
         db.session.commit()
-        
-        return jsonify({"message": "File uploaded and processed successfully", "id": kb_item.id})
+
+        submit_job(current_app._get_current_object(), job.id)
+
+        return jsonify({
+            "message": "File uploaded, processing in background",
+            "jobId": job.id,
+            "statusUrl": f"/api/admin/knowledge/jobs/{job.id}"
+        }), 202
     except Exception as e:
-        print(f"Error processing PDF: {e}")
+        print(f"Error queuing file: {e}")
         return jsonify({"error": f"Failed to process file: {str(e)}"}), 500
 
+@admin_bp.route('/knowledge/jobs/<int:id>', methods=['GET'])
+def get_ingestion_job(id):
+    from models import IngestionJob
+    from services.ingestion import job_to_dict
+    job = db.session.get(IngestionJob, id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_to_dict(job))
+
 @admin_bp.route('/knowledge', methods=['GET'])
 def get_knowledge_base():
     from models import KnowledgeBase
-    items = KnowledgeBase.query.order_by(KnowledgeBase.created_at.desc()).all()
+    # Stored preview and length only, the extracted text is never read here
+    items = db.session.query(
+        KnowledgeBase.id, KnowledgeBase.title, KnowledgeBase.file_type, KnowledgeBase.created_at,
+        KnowledgeBase.preview, KnowledgeBase.char_count
+    ).order_by(KnowledgeBase.created_at.desc()).all()
     
     result = []
     for item in items:
+        preview = item.preview or ""
         result.append({
             "id": item.id,
             "title": item.title,
             "fileType": item.file_type,
             "createdAt": item.created_at.isoformat(),
-            "contentPreview": item.content[:100] + "..." if len(item.content) > 100 else item.content
+            "charCount": item.char_count,
+            "contentPreview": preview[:100] + "..." if (item.char_count or 0) > 100 else preview
         })
     return jsonify({"documents": result})
 
@@ -182,7 +325,33 @@ def delete_knowledge(id):
     item = db.session.get(KnowledgeBase, id)
     if not item:
         return jsonify({"error": "Document not found"}), 404
-        
+
+    from services.knowledge_index import delete_document_index, bump_kb_version
+    delete_document_index(item.id)
     db.session.delete(item)
+    bump_kb_version()
     db.session.commit()
     return jsonify({"message": "Document deleted"})
+
+@admin_bp.route('/cache/responses', methods=['GET'])
+def get_response_cache_stats():
+    from models import ResponseCache
+    entries, hits = db.session.query(func.count(ResponseCache.id), func.coalesce(func.sum(ResponseCache.hits), 0)).one()
+    return jsonify({"entries": entries, "hits": int(hits)})
+
+@admin_bp.route('/cache/responses', methods=['DELETE'])
+def purge_response_cache():
+    from services.response_cache import purge_responses
+    deleted = purge_responses()
+    return jsonify({"message": "Response cache purged", "deleted": deleted})
+
+@admin_bp.route('/llm/stats', methods=['GET'])
+def get_llm_stats():
+    from services.llm_gateway import get_gateway_stats
+    from services.chat_engine import get_usage_totals
+    return jsonify({"providers": get_gateway_stats(), "usage": get_usage_totals()})
+
+@admin_bp.route('/admission/stats', methods=['GET'])
+def get_admission_stats():
+    from services.admission import get_admission_stats as admission_stats
+    return jsonify(admission_stats())
@@ -15,10 +15,63 @@ def create_app():
     app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max
     UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'uploads')
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    # A retried chat turn with no stored reply is generated again once its first attempt is this old
+    # (longer than the gunicorn timeout, so that attempt is gone)
+    app.config['CHAT_TURN_LEASE_SECONDS'] = int(os.getenv('CHAT_TURN_LEASE_SECONDS', '180'))
 
     from admin_routes import admin_bp
     app.register_blueprint(admin_bp)
 
+    @app.before_request
+    def start_request_timer():
+        import time
+        from flask import g
+        g.request_started = time.perf_counter()
+        g.request_log = {} # Extra fields for the structured request log (timings, conversation...)
+
+    @app.after_request
+    def record_request_metrics(response):
+        import time
+        from flask import g, request
+        from services import metrics
+
+        started = g.get('request_started')
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        method, status, request_log = request.method, response.status_code, g.request_log
+
+        def finish():
+            # Runs once the body has been sent, so streamed responses are measured to the end
+            elapsed = time.perf_counter() - started
+            metrics.http_requests.inc(method=method, route=route, status=status)
+            metrics.http_duration.observe(elapsed, method=method, route=route)
+            metrics.log_request(dict(event="request", method=method, route=route, status=status,
+                                     seconds=round(elapsed, 4), **request_log))
+            metrics.registry.flush()
+
+        response.call_on_close(finish)
+        return response
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        from flask import Response
+        from services import metrics
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    def timed_commit(stage):
+        """Commits the session and records how long it took as a chat stage."""
+        import time
+        from flask import g
+        from services import metrics
+
+        started = time.perf_counter()
+        db.session.commit()
+        elapsed = round(time.perf_counter() - started, 4)
+        metrics.chat_stage_duration.observe(elapsed, stage=stage)
+        g.request_log.setdefault("timings", {})[stage] = elapsed
+
     @app.route('/')
     def index():
          return "LegalTech Backend API is running. Use /api/health or /api/login."
@@ -62,6 +115,7 @@ def create_app():
     def register():
         from flask import request
         from models import User
+        from services import stats
         
         data = request.get_json()
         email = data.get('email')
@@ -88,6 +142,7 @@ def create_app():
         )
         
         db.session.add(new_user)
+        stats.increment(stats.USERS)
         db.session.commit()
         
         msg = "Usuario creado exitosamente."
@@ -99,7 +154,10 @@ def create_app():
     @app.route('/api/upload', methods=['POST'])
     def upload_document():
         from flask import request
-        import io
+        import uuid
+        from werkzeug.utils import secure_filename
+        from services.extraction import SUPPORTED_EXTENSIONS, ExtractionError, file_extension
+        from services.documents import store_uploaded_document, document_to_dict
         
         if 'file' not in request.files:
             return {"error": "No se envió ningún archivo"}, 400
@@ -108,160 +166,419 @@ def create_app():
         if file.filename == '':
             return {"error": "Nombre de archivo vacío"}, 400
         
-        filename = file.filename.lower()
-        allowed_extensions = {'.pdf', '.docx', '.txt'}
-        ext = '.' + filename.rsplit('.', 1)[-1] if '.' in filename else ''
+        ext = file_extension(file.filename)
         
-        if ext not in allowed_extensions:
-            return {"error": f"Tipo de archivo no soportado. Use: {', '.join(allowed_extensions)}"}, 400
+        if ext not in SUPPORTED_EXTENSIONS:
+            return {"error": f"Tipo de archivo no soportado. Use: {', '.join(SUPPORTED_EXTENSIONS)}"}, 400
         
+        # Stream the upload to disk instead of holding it in memory while parsing
+        file_path = os.path.join(UPLOAD_FOLDER, f"upload_{uuid.uuid4().hex}_{secure_filename(file.filename)}")
         try:
-            extracted_text = ''
-            
-            if ext == '.pdf':
-                from PyPDF2 import PdfReader
-                reader = PdfReader(io.BytesIO(file.read()))
-                for page in reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        extracted_text += page_text + '\n'
-            
-            elif ext == '.docx':
-                from docx import Document
-                doc = Document(io.BytesIO(file.read()))
-                for para in doc.paragraphs:
-                    if para.text.strip():
-                        extracted_text += para.text + '\n'
-                # Also extract text from tables
-                for table in doc.tables:
-                    for row in table.rows:
-                        row_text = ' | '.join(cell.text.strip() for cell in row.cells)
-                        extracted_text += row_text + '\n'
-            
-            elif ext == '.txt':
-                content = file.read()
-                # Try UTF-8 first, then latin-1
-                try:
-                    extracted_text = content.decode('utf-8')
-                except UnicodeDecodeError:
-                    extracted_text = content.decode('latin-1')
+            file.save(file_path)
+            # The text stays on the server; clients send back the documentId in /api/chat
+            document, deduplicated, result = store_uploaded_document(file_path, file.filename, ext)
             
-            if not extracted_text.strip():
-                return {"error": "No se pudo extraer texto del archivo. El archivo puede estar vacío o protegido."}, 400
-            
-            return {
-                "status": "success",
-                "filename": file.filename,
-                "text": extracted_text,
-                "characters": len(extracted_text)
-            }
-        
+            response = {"status": "success", "deduplicated": deduplicated}
+            response.update(document_to_dict(document))
+            if result:
+                from flask import g
+                from services import metrics
+                metrics.extraction_duration.observe(result.seconds, source='upload', file_type=ext.lstrip('.'))
+                metrics.extraction_pages.observe(result.pages, source='upload', file_type=ext.lstrip('.'))
+                response["extraction"] = result.to_dict()
+                g.request_log["extraction"] = response["extraction"]
+            return response
+        
+        except ExtractionError as e:
+            return {"error": str(e)}, 400
         except Exception as e:
             print(f"Error processing file: {e}")
             return {"error": f"Error al procesar el archivo: {str(e)}"}, 500
+        finally:
+            if os.path.exists(file_path):
+                os.remove(file_path)
 
-    @app.route('/api/chat', methods=['POST'])
-    def chat():
+    def chat_document_context(data):
+        """{documentId} for documents uploaded through /api/upload, or the legacy inline {filename, text}."""
+        if data.get('documentId'):
+            # documentMode 'full' asks for a summary of the whole document instead of the relevant passages
+            return {"documentId": data['documentId'], "mode": data.get('documentMode')}
+        return data.get('documentContext')
+
+    def chat_idempotency_key(data):
+        """Client key for the user turn: Idempotency-Key header or clientMessageId in the body."""
         from flask import request
+        return request.headers.get('Idempotency-Key') or data.get('clientMessageId')
+
+    def stored_idempotency_key(data, client_key):
+        """Key stored with the user turn: the client key scoped to the requesting user (client IP if anonymous),
+        hashed to fit the column, so equal keys sent by different clients never share a turn."""
+        import hashlib
+        return hashlib.sha256(f"{admission_key(data)}\x1f{client_key}".encode('utf-8')).hexdigest()
+
+    def replay_chat_turn(user_msg):
+        """Answer for a retried turn: the stored reply, or 409 while the first attempt still holds the turn's lease.
+
+        Returns None when the lease is stale (the first attempt died before storing a reply) and this request
+        took it over: the caller generates the reply again for the existing user message.
+        """
+        import json
+        from datetime import datetime, timedelta
+        from sqlalchemy import update, or_
         from models import Conversation, Message
-        from services.chat_engine import generate_response
-        
-        data = request.get_json()
+        from services.chat_engine import classify_status
+
+        reply = db.session.query(Message.content, Message.status, Message.suggested_actions).filter(
+            Message.conversation_id == user_msg.conversation_id,
+            Message.sender_role == 'assistant',
+            Message.id > user_msg.id
+        ).order_by(Message.id).first()
+        if not reply:
+            now = datetime.utcnow()
+            stale = now - timedelta(seconds=app.config['CHAT_TURN_LEASE_SECONDS'])
+            # Conditional UPDATE, so only one of several concurrent retries takes the turn over
+            claimed = db.session.execute(
+                update(Message)
+                .where(Message.id == user_msg.id,
+                       or_(Message.processing_started_at <= stale,
+                           Message.processing_started_at.is_(None) & (Message.created_at <= stale)))
+                .values(processing_started_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                return None
+            return {"error": "Esta solicitud ya se está procesando", "conversationId": user_msg.conversation_id}, 409
+        title = db.session.query(Conversation.title).filter_by(id=user_msg.conversation_id).scalar()
+        return {
+            "conversationId": user_msg.conversation_id,
+            "response": reply.content,
+            # Replies stored before the status column existed are classified again
+            "status": reply.status or classify_status(reply.content),
+            "suggestedActions": json.loads(reply.suggested_actions) if reply.suggested_actions else [],
+            "title": title,
+            "replayed": True
+        }
+
+    def resume_chat_turn(user_msg, msg_content, conversation_id):
+        """start_chat_turn result for a turn already stored under the same idempotency key."""
+        from models import Conversation
+
+        if user_msg.content != msg_content or (conversation_id and str(user_msg.conversation_id) != str(conversation_id)):
+            # Same key, different turn: never answer it with another turn's reply
+            return None, ({"error": "Idempotency-Key ya usada para otro mensaje"}, 422)
+        response = replay_chat_turn(user_msg)
+        if response is not None:
+            return None, response
+        title = db.session.query(Conversation.title).filter_by(id=user_msg.conversation_id).scalar()
+        turn = {"conversation_id": user_msg.conversation_id, "title": title, "message_id": user_msg.id}
+        db.session.close()
+        return turn, None
+
+    def start_chat_turn(data):
+        """Gets or creates the conversation and commits the user message.
+
+        Returns (turn, response): `turn` has conversation_id, title and message_id; `response` is set instead
+        when the request must be answered right away (validation error or a retried idempotency key).
+        """
+        from datetime import datetime
+        from sqlalchemy.exc import IntegrityError
+        from models import Conversation, Message
+        from services import stats
+        from services.conversations import record_message
+
         user_id = data.get('userId') # Optional if anonymous
         message_text = data.get('message')
         conversation_id = data.get('conversationId')
-        document_context = data.get('documentContext')  # {filename, text}
-        
+        document_context = chat_document_context(data)
+        idempotency_key = chat_idempotency_key(data)
+
         if not message_text:
-            return {"error": "Message required"}, 400
-            
+            return None, ({"error": "Message required"}, 400)
+        if idempotency_key and len(idempotency_key) > 64:
+            return None, ({"error": "Idempotency-Key demasiado largo (máximo 64 caracteres)"}, 400)
+
+        if document_context and 'documentId' in document_context:
+            from models import UploadedDocument
+            filename = db.session.query(UploadedDocument.filename).filter_by(id=document_context['documentId']).scalar()
+            if not filename:
+                return None, ({"error": "Documento no encontrado"}, 404)
+            document_context['filename'] = filename
+
+        # User message as stored (include document info if present)
+        msg_content = message_text
+        if document_context:
+            msg_content = f"📎 [{document_context.get('filename', 'Documento')}]\n{message_text}"
+
+        if idempotency_key:
+            idempotency_key = stored_idempotency_key(data, idempotency_key)
+            existing = Message.query.filter_by(idempotency_key=idempotency_key).first()
+            if existing:
+                return resume_chat_turn(existing, msg_content, conversation_id)
+
         # 1. Get or Create Conversation
         if not conversation_id:
             title = message_text[:40] + "..." if len(message_text) > 40 else message_text
             conv = Conversation(user_id=user_id, title=title)
             db.session.add(conv)
-            db.session.commit()
-            conversation_id = conv.id
+            db.session.flush()
+            stats.increment(stats.CONVERSATIONS)
         else:
             conv = db.session.get(Conversation, conversation_id)
             if not conv:
-                return {"error": "Conversation not found"}, 404
+                return None, ({"error": "Conversation not found"}, 404)
         
-        # 2. Save User Message (include document info if present)
-        msg_content = message_text
-        if document_context:
-            msg_content = f"📎 [{document_context.get('filename', 'Documento')}]\n{message_text}"
-        user_msg = Message(conversation_id=conversation_id, sender_role='user', content=msg_content)
+        # 2. Save User Message in its own short transaction
+        now = datetime.utcnow()
+        user_msg = Message(conversation_id=conv.id, sender_role='user', content=msg_content,
+                           idempotency_key=idempotency_key, created_at=now, processing_started_at=now)
         db.session.add(user_msg)
-        
-        # 3. Generate AI Response (with document context if present)
-        ai_result = generate_response(message_text, conversation_id, document_context=document_context)
-        ai_text = ai_result['text']
-        
-        # 4. Save AI Message
-        ai_msg = Message(conversation_id=conversation_id, sender_role='assistant', content=ai_text)
+        record_message(user_msg)
+        stats.record_activity(conv.user_id)
+        try:
+            timed_commit('db_commit_user_turn')
+        except IntegrityError:
+            # Same key sent concurrently, the other request owns the turn
+            db.session.rollback()
+            existing = Message.query.filter_by(idempotency_key=idempotency_key).first()
+            if not existing:
+                raise
+            return resume_chat_turn(existing, msg_content, conversation_id)
+
+        turn = {"conversation_id": conv.id, "title": conv.title, "message_id": user_msg.id}
+        # Release the pooled connection; the LLM call must not hold it
+        db.session.close()
+        return turn, None
+
+    def log_chat_result(conversation_id, ai_result):
+        from flask import g
+        g.request_log["conversationId"] = conversation_id
+        g.request_log.setdefault("timings", {}).update(ai_result.get("timings") or {})
+        for key in ("provider", "cached", "prompt_chars"):
+            if key in ai_result:
+                g.request_log[key] = ai_result[key]
+        if ai_result.get("prompt_tokens"):
+            g.request_log["promptTokens"] = ai_result["prompt_tokens"].get("total")
+        if ai_result.get("usage"):
+            g.request_log["usage"] = ai_result["usage"]
+
+    def finish_chat_turn(turn, ai_result):
+        """Saves the AI message and the detected status in a second short transaction, and builds the /api/chat response body."""
+        import json
+        from datetime import datetime
+        from sqlalchemy import update
+        from models import Conversation, Message
+        from services import stats
+        from services.conversations import record_message
+
+        conv = db.session.get(Conversation, turn['conversation_id'])
+        ai_msg = Message(conversation_id=conv.id, sender_role='assistant', content=ai_result['text'], created_at=datetime.utcnow(),
+                         status=ai_result['status'], suggested_actions=json.dumps(ai_result.get('suggested_actions', [])))
         db.session.add(ai_msg)
-        
-        db.session.commit()
-        
+        # The turn has its reply, release its lease
+        db.session.execute(update(Message).where(Message.id == turn['message_id']).values(processing_started_at=None)
+                           .execution_options(synchronize_session=False))
+        record_message(ai_msg)
+        stats.record_activity(conv.user_id)
+        if ai_result['status'] == 'risk' and conv.status == 'active':
+            conv.status = 'risk_detected'
+            stats.increment(stats.RISK_CASES)
+        conv.updated_at = datetime.utcnow()
+        
+        timed_commit('db_commit_assistant_turn')
+        log_chat_result(conv.id, ai_result)
         
         return {
-            "conversationId": conversation_id,
-            "response": ai_text,
+            "conversationId": conv.id,
+            "response": ai_result['text'],
             "status": ai_result['status'],
             "suggestedActions": ai_result.get('suggested_actions', []),
             "title": conv.title
         }
 
+    def admission_key(data):
+        """Rate limits and fair queueing are per user, or per client IP for anonymous chats."""
+        from flask import request
+        if data.get('userId'):
+            return f"user:{data['userId']}"
+        return f"ip:{request.remote_addr}"
+
+    def admission_rejected(e):
+        return {"error": str(e), "reason": e.reason, "retryAfter": e.retry_after}, e.status_code, {"Retry-After": str(e.retry_after)}
+
+    @app.route('/api/chat', methods=['POST'])
+    def chat():
+        from flask import request
+        from services import admission
+        from services.chat_engine import generate_response
+        
+        data = request.get_json()
+        # Per-user rate limit + global concurrency cap, before anything is written
+        try:
+            admission.acquire(admission_key(data))
+        except admission.AdmissionRejected as e:
+            return admission_rejected(e)
+
+        try:
+            turn, response = start_chat_turn(data)
+            if response:
+                return response
+            
+            # 3. Generate AI Response (with document context if present), no DB connection held meanwhile
+            ai_result = generate_response(data['message'], turn['conversation_id'], document_context=chat_document_context(data),
+                                          first_turn=not data.get('conversationId'), message_id=turn['message_id'])
+            
+            # 4. Save AI Message
+            return finish_chat_turn(turn, ai_result)
+        finally:
+            admission.release()
+
+    @app.route('/api/chat/stream', methods=['POST'])
+    def chat_stream():
+        """Same contract as /api/chat, but tokens are pushed as Server-Sent Events while they are generated."""
+        from flask import request, Response, stream_with_context
+        import json
+        from services import admission
+        from services.chat_engine import stream_response
+
+        data = request.get_json()
+        try:
+            admission.acquire(admission_key(data))
+        except admission.AdmissionRejected as e:
+            return admission_rejected(e)
+
+        # The user turn is committed before streaming, so it survives a client disconnect
+        try:
+            turn, response = start_chat_turn(data)
+        except Exception:
+            admission.release()
+            raise
+        if response and (not isinstance(response, dict) or not response.get('replayed')):
+            admission.release()
+            return response
+
+        def sse(event, payload):
+            return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        def replay_events():
+            yield sse('start', {"conversationId": response['conversationId'], "title": response['title']})
+            yield sse('token', {"text": response['response']})
+            yield sse('done', response)
+
+        def events():
+            generation = stream_response(data['message'], turn['conversation_id'], document_context=chat_document_context(data),
+                                         first_turn=not data.get('conversationId'), message_id=turn['message_id'])
+            ai_result = None
+            try:
+                yield sse('start', {"conversationId": turn['conversation_id'], "title": turn['title']})
+                for event in generation:
+                    if event['type'] == 'token':
+                        yield sse('token', {"text": event['text']})
+                    elif event['type'] == 'action':
+                        yield sse('action', {"action": event['action']})
+                    elif event['type'] == 'done':
+                        ai_result = event['result']
+            except GeneratorExit:
+                # The client went away: read the LLM stream to the end anyway and store the reply (and its cache
+                # entry), so the conversation does not end on an unanswered turn and a retry can replay it
+                for event in generation:
+                    if event['type'] == 'done':
+                        ai_result = event['result']
+                finish_chat_turn(turn, ai_result)
+                raise
+            yield sse('done', finish_chat_turn(turn, ai_result))
+
+        stream = Response(stream_with_context(replay_events() if response else events()), mimetype='text/event-stream', headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering (nginx)
+        })
+        # The admission slot is held until the stream is finished or the client goes away
+        stream.call_on_close(admission.release)
+        return stream
+
     @app.route('/api/conversations/<int:user_id>', methods=['GET'])
     def get_conversations(user_id):
+        from flask import request
         from models import Conversation
-        convs = Conversation.query.filter_by(user_id=user_id).order_by(Conversation.updated_at.desc()).all()
-        
+        from services.pagination import page_params, keyset_page, page_info
+        try:
+            limit, before, after = page_params(request.args)
+        except ValueError:
+            return {"error": "Parámetros de paginación inválidos"}, 400
+
+        # Most recent activity first; ?before=<cursor> continues with older ones
+        query = db.session.query(
+            Conversation.id, Conversation.title, Conversation.updated_at, Conversation.last_message_at,
+            Conversation.message_count, Conversation.last_message_preview
+        ).filter(Conversation.user_id == user_id)
+        convs, has_more = keyset_page(query, Conversation.last_message_at, Conversation.id, limit, before, after)
+
         result = []
         for c in convs:
-            # Get last message / simple summary
             result.append({
                 "id": c.id,
                 "title": c.title,
-                "updated_at": c.updated_at.isoformat()
+                "updated_at": c.updated_at.isoformat(),
+                "lastMessageAt": c.last_message_at.isoformat() if c.last_message_at else None,
+                "messageCount": c.message_count,
+                "lastMessagePreview": c.last_message_preview
             })
-        return {"conversations": result}
+        return {"conversations": result, "paging": page_info(convs, 'last_message_at', limit, has_more)}
         
     @app.route('/api/conversations/<int:conversation_id>/messages', methods=['GET'])
     def get_messages(conversation_id):
+        from flask import request
         from models import Message
-        msgs = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.created_at.asc()).all()
-        
+        from services.pagination import page_params, keyset_page, page_info
+        try:
+            limit, before, after = page_params(request.args)
+        except ValueError:
+            return {"error": "Parámetros de paginación inválidos"}, 400
+
+        # The newest page is loaded first and ?before=<cursor> scrolls back through older messages.
+        # Within a page messages keep chronological order, as the chat shows them.
+        query = db.session.query(Message.id, Message.sender_role, Message.content, Message.created_at).filter(
+            Message.conversation_id == conversation_id)
+        msgs, has_more = keyset_page(query, Message.created_at, Message.id, limit, before, after)
+        paging = page_info(msgs, 'created_at', limit, has_more)
+
         result = []
-        for m in msgs:
+        for m in reversed(msgs):
             result.append({
                 "id": m.id,
                 "role": m.sender_role,
                 "content": m.content,
                 "timestamp": m.created_at.isoformat()
             })
-        return {"messages": result}
+        return {"messages": result, "paging": paging}
 
     @app.route('/api/user/<int:user_id>/profile', methods=['GET'])
     def get_user_profile(user_id):
-        from models import User, Conversation, Message
+        from sqlalchemy import func
+        from models import User, Conversation
         
         user = db.session.get(User, user_id)
         if not user:
             return {"error": "Usuario no encontrado"}, 404
         
-        # Get stats
-        total_conversations = Conversation.query.filter_by(user_id=user_id).count()
-        total_messages = Message.query.join(Conversation).filter(Conversation.user_id == user_id).count()
+        # Get stats (message counts are kept on each conversation, no join on messages)
+        total_conversations, total_messages = db.session.query(
+            func.count(Conversation.id), func.coalesce(func.sum(Conversation.message_count), 0)
+        ).filter(Conversation.user_id == user_id).one()
         
         # Get recent conversations
-        convs = Conversation.query.filter_by(user_id=user_id).order_by(Conversation.updated_at.desc()).limit(10).all()
+        convs = db.session.query(
+            Conversation.id, Conversation.title, Conversation.status, Conversation.updated_at,
+            Conversation.last_message_at, Conversation.message_count
+        ).filter(Conversation.user_id == user_id).order_by(
+            Conversation.last_message_at.desc(), Conversation.id.desc()).limit(10).all()
         conversations = [{
             "id": c.id,
             "title": c.title,
             "status": c.status,
-            "updated_at": c.updated_at.isoformat()
+            "updated_at": c.updated_at.isoformat(),
+            "lastMessageAt": c.last_message_at.isoformat() if c.last_message_at else None,
+            "messageCount": c.message_count
         } for c in convs]
         
         return {
@@ -275,7 +592,7 @@ def create_app():
             },
             "stats": {
                 "totalConversations": total_conversations,
-                "totalMessages": total_messages
+                "totalMessages": int(total_messages)
             },
             "conversations": conversations
         }
@@ -0,0 +1,286 @@
+"""Benchmark reproducible del pipeline de chat, sin servicios externos.
+
+Arranca create_app() sobre una base SQLite temporal, con benchmarks/fake_openai.py como LLM (latencia y
+streaming configurables) y un DDGS simulado. Lanza /api/chat, /api/chat/stream, /api/upload y los
+listados con la concurrencia indicada y guarda p50/p95/p99 y throughput en un JSON comparable entre commits:
+
+    python benchmarks/bench_chat.py --requests 200 --concurrency 20 --output before.json
+    python benchmarks/bench_chat.py --requests 200 --concurrency 20 --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import http.client
+from datetime import datetime
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+from fake_openai import start_server
+from bench_utils import free_port, latency_summary, request, post_json, post_file, git_revision
+
+SCENARIOS = ('chat', 'stream', 'upload', 'list')
+
+QUESTIONS = [
+    "Me despidieron sin justa causa, ¿qué indemnización me corresponde?",
+    "¿Cuánto puede subir el arriendo de un local comercial al año?",
+    "Necesito renovar mi visa de trabajo, ¿qué documentos piden?",
+    "¿Cómo se liquidan las cesantías de un contrato a término fijo?",
+    "El arrendatario no paga hace tres meses, ¿qué puedo hacer?",
+    "¿Qué es el permiso por protección temporal?",
+    "¿Cuántos días de vacaciones tengo después de un año de trabajo?",
+    "¿Puedo terminar el contrato de arrendamiento antes de tiempo?",
+]
+
+CLAUSE = ("CLÁUSULA {n}. El ARRENDATARIO pagará el canon mensual de ${value} dentro de los cinco primeros días "
+          "de cada mes. El incumplimiento dará lugar a la terminación del contrato conforme a la Ley 820 de 2003. ")
+
+
+class FakeDDGS:
+    """Reemplazo de duckduckgo_search.DDGS con latencia fija."""
+    latency = 0.3
+
+    def text(self, query, max_results=3):
+        time.sleep(self.latency)
+        return [
+            {"title": f"Resultado {i + 1} para {query[:40]}", "body": "Texto de ejemplo sobre la normativa colombiana vigente.",
+             "href": f"https://example.org/resultado-{i + 1}"}
+            for i in range(max_results)
+        ]
+
+
+def configure_environment(args, workdir, llm_url):
+    # Must run before the app modules are imported, they read their settings at import time
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "DEEPSEEK_API_KEY": "sk-bench",
+        "DEEPSEEK_BASE_URL": llm_url,
+        "LLM_PROVIDERS": "deepseek",
+        "RESPONSE_CACHE_ENABLED": "1" if args.response_cache else "0",
+        "SEARCH_CACHE_BACKEND": "memory",
+        "WEB_SEARCH_ENABLED": "1",
+        "REQUEST_LOG": "0",
+        "USER_BURST": "1000000",
+        "ADMISSION_USER_QUEUE": "1000000",
+    })
+    os.environ.pop("METRICS_DIR", None)
+
+
+def seed(app, args):
+    """Usuarios y conversaciones previas para que historial y listados tengan datos."""
+    from extensions import db
+    from models import User, Conversation, Message
+
+    with app.app_context():
+        db.create_all()
+        users = [User(email=f"bench{i}@example.org", password_hash="bench", full_name=f"Usuario {i}", is_approved=True)
+                 for i in range(args.users)]
+        db.session.add_all(users)
+        db.session.flush()
+        conversations = {}
+        for user in users:
+            for c in range(args.seed_conversations):
+                conv = Conversation(user_id=user.id, title=f"Consulta {c}", message_count=args.seed_messages)
+                db.session.add(conv)
+                db.session.flush()
+                conversations.setdefault(user.id, []).append(conv.id)
+                for m in range(args.seed_messages):
+                    role = 'user' if m % 2 == 0 else 'assistant'
+                    db.session.add(Message(conversation_id=conv.id, sender_role=role,
+                                           content=f"{QUESTIONS[(c + m) % len(QUESTIONS)]} ({role} {m})"))
+        db.session.commit()
+        return conversations
+
+
+def stream_chat(base_url, payload):
+    """(status, segundos hasta el primer token, segundos totales) de /api/chat/stream."""
+    parsed = urlparse(base_url)
+    started = time.perf_counter()
+    first_token = None
+    try:
+        conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=300)
+        conn.request("POST", "/api/chat/stream", body=json.dumps(payload).encode('utf-8'),
+                     headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        status = response.status
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            if first_token is None and line.startswith(b"event: token"):
+                first_token = time.perf_counter() - started
+        conn.close()
+    except Exception:
+        status = None
+    return status, first_token, time.perf_counter() - started
+
+
+def make_docx(paragraphs):
+    import io
+    from docx import Document
+    document = Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def run_scenario(name, args, base_url, conversations):
+    rng = random.Random(args.seed)
+    user_ids = sorted(conversations)
+    lock = threading.Lock()
+    ttfb = []
+
+    def one(index):
+        user_id = user_ids[index % len(user_ids)]
+        question = f"{QUESTIONS[index % len(QUESTIONS)]} (caso {index})"
+        if name in ('chat', 'stream'):
+            payload = {"message": question, "userId": user_id}
+            if index % 2:
+                # Half of the turns continue an existing conversation (history + summary)
+                with lock:
+                    payload["conversationId"] = rng.choice(conversations[user_id])
+            if name == 'chat':
+                status, _, seconds = post_json(base_url + "/api/chat", payload)
+                return status, seconds
+            status, first_token, seconds = stream_chat(base_url, payload)
+            if first_token is not None:
+                with lock:
+                    ttfb.append(first_token)
+            return status, seconds
+        if name == 'upload':
+            # Distinct content every time so deduplication does not short-circuit extraction
+            paragraphs = [CLAUSE.format(n=n, value=1000000 + index * 1000 + n) for n in range(args.upload_clauses)]
+            if index % 2:
+                status, _, seconds = post_file(base_url + "/api/upload", "file", f"contrato_{index}.docx", make_docx(paragraphs),
+                                               "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+            else:
+                status, _, seconds = post_file(base_url + "/api/upload", "file", f"contrato_{index}.txt",
+                                               "\n\n".join(paragraphs).encode('utf-8'), "text/plain")
+            return status, seconds
+        # list: rotate through the three read endpoints
+        kind = index % 3
+        if kind == 0:
+            status, _, seconds = request(f"{base_url}/api/conversations/{user_id}")
+        elif kind == 1:
+            with lock:
+                conversation_id = rng.choice(conversations[user_id])
+            status, _, seconds = request(f"{base_url}/api/conversations/{conversation_id}/messages")
+        else:
+            status, _, seconds = request(f"{base_url}/api/user/{user_id}/profile")
+        return status, seconds
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latencies = [seconds for status, seconds in results if status == 200]
+    report = {
+        "requests": len(results),
+        "ok": len(latencies),
+        "errors": len(results) - len(latencies),
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency": latency_summary(latencies),
+    }
+    if name == 'stream':
+        report["first_token"] = latency_summary(ttfb)
+    return report
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline.get('revision')})")
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        for metric in ("p50", "p95", "p99"):
+            old, new = before["latency"][metric], result["latency"][metric]
+            if old and new:
+                print(f"  {name:<7} {metric}: {old:.4f}s -> {new:.4f}s ({(new - old) / old:+.1%})")
+        old, new = before["throughput"], result["throughput"]
+        if old and new:
+            print(f"  {name:<7} throughput: {old} -> {new} req/s ({(new - old) / old:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--requests', type=int, default=100, help="Requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="Seconds before the fake LLM answers")
+    parser.add_argument('--chunk-delay', type=float, default=0.02, help="Seconds between streamed chunks")
+    parser.add_argument('--search-latency', type=float, default=0.3, help="Seconds per fake DDGS search")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--seed-conversations', type=int, default=20, help="Existing conversations per user")
+    parser.add_argument('--seed-messages', type=int, default=10, help="Messages per existing conversation")
+    parser.add_argument('--upload-clauses', type=int, default=200, help="Paragraphs per uploaded document")
+    parser.add_argument('--response-cache', action='store_true', help="Leave the response cache on")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="JSON file for the results (default benchmarks/results/chat_<revision>.json)")
+    parser.add_argument('--compare', help="Previous results JSON to compare against")
+    args = parser.parse_args()
+
+    llm_server, llm_url = start_server(latency=args.llm_latency, chunk_delay=args.chunk_delay)
+    workdir = tempfile.mkdtemp(prefix='bench_chat_')
+    configure_environment(args, workdir, llm_url)
+
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import services.chat_engine as chat_engine
+    from app import create_app
+
+    FakeDDGS.latency = args.search_latency
+    chat_engine.DDGS = FakeDDGS
+
+    app = create_app()
+    conversations = seed(app, args)
+    port = free_port()
+    quiet_handler = type('QuietHandler', (WSGIRequestHandler,), {"log_request": lambda *a, **k: None})
+    server = make_server('127.0.0.1', port, app, threaded=True, request_handler=quiet_handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{port}"
+
+    results = {
+        "revision": git_revision(REPO_DIR),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        "scenarios": {},
+    }
+    for name in args.scenarios:
+        results["scenarios"][name] = run_scenario(name, args, base_url, conversations)
+        summary = results["scenarios"][name]
+        print(f"{name:<7} ok={summary['ok']}/{summary['requests']} {summary['throughput']} req/s "
+              f"p50={summary['latency']['p50']} p95={summary['latency']['p95']} p99={summary['latency']['p99']}")
+
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"chat_{results['revision'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+    server.shutdown()
+    llm_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
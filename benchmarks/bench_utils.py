@@ -0,0 +1,70 @@
+"""Utilidades compartidas por los scripts de benchmarks/."""
+import json
+import time
+import uuid
+import socket
+import subprocess
+import urllib.error
+import urllib.request
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def latency_summary(latencies):
+    """p50/p95/p99/media/máximo en segundos."""
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {
+        "p50": round(percentile(latencies, 0.50), 4),
+        "p95": round(percentile(latencies, 0.95), 4),
+        "p99": round(percentile(latencies, 0.99), 4),
+        "mean": round(sum(latencies) / len(latencies), 4),
+        "max": round(max(latencies), 4),
+    }
+
+
+def request(url, data=None, headers=None, method=None, timeout=300, read=True):
+    """Returns (status, body bytes, seconds). Network errors give status None."""
+    req = urllib.request.Request(url, data=data, headers=headers or {}, method=method)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            body = response.read() if read else b''
+            return response.status, body, time.perf_counter() - started
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), time.perf_counter() - started
+    except Exception:
+        return None, b'', time.perf_counter() - started
+
+
+def post_json(url, payload, headers=None, timeout=300):
+    headers = dict(headers or {}, **{"Content-Type": "application/json"})
+    return request(url, json.dumps(payload).encode('utf-8'), headers, timeout=timeout)
+
+
+def post_file(url, field, filename, content, content_type='application/octet-stream', timeout=300):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'
+    ).encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return request(url, body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}, timeout=timeout)
+
+
+def git_revision(repo_dir):
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
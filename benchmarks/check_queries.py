@@ -0,0 +1,104 @@
+"""Comprueba que los endpoints de listado y administración no vuelvan a tener consultas N+1.
+
+Llena una base SQLite temporal con dos volúmenes distintos y cuenta las sentencias SQL de cada endpoint con
+benchmarks/bench_db.QueryCounter. Falla (código de salida 1) si un endpoint supera su presupuesto o si el
+número de consultas crece con los datos:
+
+    python benchmarks/check_queries.py
+"""
+import os
+import sys
+import tempfile
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# Maximum statements per request, whatever the amount of data
+QUERY_BUDGETS = {
+    "/api/admin/users": 2,
+    "/api/admin/users?sort=conversationCount&approved=true&role=client&joinedFrom=2000-01-01": 2,
+    "/api/admin/conversations": 2,
+    "/api/admin/conversations?status=active&sort=createdAt&order=asc&page=2&pageSize=5": 2,
+    "/api/admin/stats": 2,
+    "/api/conversations/{user_id}": 1,
+    "/api/conversations/{conversation_id}/messages": 1,
+    "/api/user/{user_id}/profile": 3,
+}
+
+
+def seed(db, users, conversations_per_user, messages_per_conversation):
+    from models import User, Conversation, Message
+
+    created = []
+    for i in range(users):
+        user = User(email=f"check{len(created)}_{i}_{users}@example.org", password_hash="check",
+                    full_name=f"Usuario {i}", is_approved=i % 3 != 0)
+        db.session.add(user)
+        created.append(user)
+    db.session.flush()
+    conversation = None
+    for user in created:
+        for c in range(conversations_per_user):
+            conversation = Conversation(user_id=user.id, title=f"Consulta {c}")
+            db.session.add(conversation)
+            db.session.flush()
+            for m in range(messages_per_conversation):
+                db.session.add(Message(conversation_id=conversation.id, sender_role='user' if m % 2 == 0 else 'assistant',
+                                       content=f"Mensaje {m}"))
+    db.session.commit()
+    return {"user_id": created[-1].id, "conversation_id": conversation.id}
+
+
+def count_queries(app, counter, targets):
+    client = app.test_client()
+    counts = {}
+    for template in QUERY_BUDGETS:
+        path = template.format(**targets)
+        client.get(path).close() # Warm-up
+        counter.reset()
+        response = client.get(path)
+        response.close()
+        if response.status_code != 200:
+            raise SystemExit(f"{path} returned {response.status_code}")
+        counts[template] = counter.count
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--small', type=int, default=5, help="Users in the first round")
+    parser.add_argument('--large', type=int, default=60, help="Users in the second round")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='check_queries_')
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'check.db')}"
+    os.environ.setdefault("DEEPSEEK_API_KEY", "sk-check")
+    os.environ["REQUEST_LOG"] = "0"
+    from app import create_app
+    from extensions import db
+    from bench_db import QueryCounter
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        counter = QueryCounter(db.engine)
+        targets = seed(db, args.small, 3, 4)
+    small = count_queries(app, counter, targets)
+    with app.app_context():
+        targets = seed(db, args.large, 6, 8)
+    large = count_queries(app, counter, targets)
+
+    failures = 0
+    for template, budget in QUERY_BUDGETS.items():
+        ok = large[template] <= budget and large[template] == small[template]
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {template:<90} queries {small[template]} -> {large[template]} (budget {budget})")
+    if failures:
+        print(f"{failures} endpoint(s) over budget or growing with the data")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
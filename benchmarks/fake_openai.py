@@ -0,0 +1,169 @@
+"""Servidor OpenAI-compatible mínimo para benchmarks y pruebas de carga.
+
+Responde /chat/completions (normal y streaming) tras una latencia configurable, sin llamar a ningún proveedor.
+Puede inyectar fallos (429, 5xx, cuota agotada) en todas, algunas o las N primeras peticiones.
+
+    python benchmarks/fake_openai.py --port 8099 --latency 1.5
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8099 DEEPSEEK_API_KEY=sk-test gunicorn -c gunicorn.conf.py
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+REPLY = (
+    "Según el artículo 64 del Código Sustantivo del Trabajo, la terminación sin justa causa "
+    "genera una indemnización a favor del trabajador. ⚠️ Revise los términos de su contrato.\n"
+    "[ACCION: Calcular Indemnización]\n[ACCION: Ver Ley 789 de 2002]"
+)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 1.0        # Seconds before the first byte
+    stream_chunks = 8    # Pieces a streamed reply is split into
+    chunk_delay = 0.02   # Seconds between streamed pieces
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+
+        server = self.server
+        failure = self.pick_failure()
+        if failure:
+            time.sleep(self.latency / 10)
+            self.send_failure(*failure)
+            return
+        with server.stats_lock:
+            server.stats["requests"] += 1
+            server.stats["in_flight"] += 1
+            server.stats["max_in_flight"] = max(server.stats["max_in_flight"], server.stats["in_flight"])
+        try:
+            time.sleep(self.latency)
+            prompt_tokens = sum(len(m.get("content") or '') for m in body.get("messages", [])) // 4 + 1
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(REPLY) // 4 + 1}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            if body.get("stream"):
+                self.send_stream(body, usage)
+            else:
+                self.send_json({
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": REPLY}}],
+                    "usage": usage
+                })
+        finally:
+            with server.stats_lock:
+                server.stats["in_flight"] -= 1
+
+    def pick_failure(self):
+        """(status, code) if this request must fail according to server.failure."""
+        server = self.server
+        with server.stats_lock:
+            failure = server.failure
+            if not failure["status"]:
+                return None
+            if failure["count"] > 0:
+                failure["count"] -= 1
+            elif failure["count"] == 0 or random.random() >= failure["rate"]:
+                return None
+            server.stats["failed"] += 1
+            return failure["status"], failure["code"]
+
+    def send_failure(self, status, code):
+        error_type = "insufficient_quota" if code == "insufficient_quota" else "server_error"
+        self.send_json({"error": {"message": f"Injected failure ({code or status})", "type": error_type, "code": code}},
+                       status=status)
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, body, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta, finish_reason=None, chunk_usage=None):
+            payload = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                "usage": chunk_usage
+            }
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        size = max(1, len(REPLY) // self.stream_chunks + 1)
+        for start in range(0, len(REPLY), size):
+            chunk({"content": REPLY[start:start + size]})
+            time.sleep(self.chunk_delay)
+        chunk({}, finish_reason="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk(None, chunk_usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def set_failure(server, status=None, rate=1.0, count=-1, code=None):
+    """Inyecta fallos: con `count` >= 0 fallan solo las `count` siguientes peticiones, si no una fracción `rate`.
+
+    status=None desactiva la inyección. code='insufficient_quota' (con status 429) simula la cuota agotada.
+    """
+    with server.stats_lock:
+        server.failure = {"status": status, "rate": rate if count < 0 else 0.0, "count": count, "code": code}
+
+
+def start_server(port=0, latency=1.0, host='127.0.0.1', chunk_delay=None):
+    """Arranca el servidor en un hilo. Devuelve (server, base_url)."""
+    attributes = {"latency": latency}
+    if chunk_delay is not None:
+        attributes["chunk_delay"] = chunk_delay
+    handler = type('Handler', (FakeOpenAIHandler,), attributes)
+    server = FakeOpenAIServer((host, port), handler)
+    server.stats = {"requests": 0, "failed": 0, "in_flight": 0, "max_in_flight": 0}
+    server.stats_lock = threading.Lock()
+    set_failure(server)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=1.0)
+    parser.add_argument('--fail-status', type=int, help="HTTP status of injected failures (e.g. 429, 503)")
+    parser.add_argument('--fail-rate', type=float, default=1.0, help="Fraction of requests that fail")
+    parser.add_argument('--fail-code', help="Error code, e.g. insufficient_quota")
+    args = parser.parse_args()
+    server, base_url = start_server(args.port, args.latency)
+    set_failure(server, args.fail_status, args.fail_rate, code=args.fail_code)
+    print(f"Fake OpenAI server on {base_url} (latency {args.latency}s)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
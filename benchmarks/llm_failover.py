@@ -0,0 +1,101 @@
+"""Comprueba el comportamiento de services/llm_gateway.py contra dos proveedores simulados.
+
+Levanta dos benchmarks/fake_openai.py (uno como DeepSeek y otro como OpenAI), les inyecta fallos y verifica
+reintentos, failover, apertura del circuito y su recuperación. Sale con código 1 si algo no se cumple.
+
+    python benchmarks/llm_failover.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_openai import start_server, set_failure
+
+MESSAGES = [{"role": "user", "content": "¿Cuánto es la indemnización por despido sin justa causa?"}]
+
+
+def main():
+    primary, primary_url = start_server(latency=0.05)
+    secondary, secondary_url = start_server(latency=0.05)
+    os.environ.update({
+        "LLM_PROVIDERS": "deepseek,openai",
+        "DEEPSEEK_API_KEY": "sk-test", "DEEPSEEK_BASE_URL": primary_url,
+        "OPENAI_API_KEY": "sk-test", "OPENAI_BASE_URL": secondary_url,
+        "LLM_BACKOFF_BASE": "0.05", "LLM_BREAKER_THRESHOLD": "3", "LLM_BREAKER_RESET_SECONDS": "1",
+    })
+    from services import llm_gateway
+
+    failures = []
+
+    def check(name, condition):
+        print(f"{'ok  ' if condition else 'FAIL'} {name}")
+        if not condition:
+            failures.append(name)
+
+    def call():
+        started = time.perf_counter()
+        try:
+            _, provider = llm_gateway.chat_completion(messages=MESSAGES)
+        except llm_gateway.LLMUnavailableError:
+            provider = None
+        return provider, time.perf_counter() - started
+
+    provider, _ = call()
+    check("healthy primary answers", provider == "deepseek")
+
+    set_failure(primary, 503, count=1)
+    provider, _ = call()
+    check("transient 503 is retried on the same provider", provider == "deepseek")
+
+    set_failure(primary, 429, count=1, code="insufficient_quota")
+    provider, _ = call()
+    check("insufficient_quota fails over without retrying", provider == "openai" and primary.failure["count"] == 0)
+    check("insufficient_quota opens the primary circuit", llm_gateway.get_gateway_stats()["deepseek"]["circuit"] == "open")
+
+    requests_before = primary.stats["requests"] + primary.stats["failed"]
+    provider, elapsed = call()
+    check("open circuit skips the primary", provider == "openai"
+          and primary.stats["requests"] + primary.stats["failed"] == requests_before)
+
+    time.sleep(1.1)
+    provider, _ = call()
+    check("half-open probe closes the circuit again", provider == "deepseek"
+          and llm_gateway.get_gateway_stats()["deepseek"]["circuit"] == "closed")
+
+    set_failure(primary, 429, count=1, code="insufficient_quota")
+    call()
+    set_failure(primary, 400, count=1)
+    time.sleep(1.1)
+    try:
+        llm_gateway.chat_completion(messages=MESSAGES)
+        rejected = False
+    except llm_gateway.LLMUnavailableError:
+        rejected = False
+    except Exception:
+        rejected = True
+    check("half-open probe rejected with 400 is raised to the caller", rejected)
+    provider, _ = call()
+    check("400 on the half-open probe does not leave the circuit stuck", provider == "deepseek"
+          and llm_gateway.get_gateway_stats()["deepseek"]["circuit"] == "closed")
+
+    set_failure(primary, 500)
+    for _ in range(3):
+        provider, _ = call()
+    check("persistent 5xx fails over", provider == "openai")
+    check("persistent 5xx opens the circuit", llm_gateway.get_gateway_stats()["deepseek"]["circuit"] == "open")
+
+    set_failure(secondary, 500)
+    provider, _ = call()
+    check("all providers down raises LLMUnavailableError", provider is None)
+
+    for name, stats in llm_gateway.get_gateway_stats().items():
+        print(name, stats)
+    primary.shutdown()
+    secondary.shutdown()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Prueba de carga de /api/chat contra un LLM simulado.
+
+Arranca benchmarks/fake_openai.py con una latencia fija, levanta gunicorn con gunicorn.conf.py sobre una
+base SQLite temporal y dispara N conversaciones concurrentes. Compara workers sync vs gevent:
+
+    python benchmarks/load_chat.py --concurrency 200 --latency 2 --worker-class sync gevent
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_openai import start_server
+from bench_utils import free_port, percentile, post_json
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MESSAGES = [
+    "Me despidieron sin justa causa, ¿qué indemnización me corresponde?",
+    "¿Cuánto puede subir el arriendo de un local comercial al año?",
+    "Necesito renovar mi visa de trabajo, ¿qué documentos piden?",
+    "¿Cómo se liquidan las cesantías de un contrato a término fijo?",
+    "El arrendatario no paga hace tres meses, ¿qué puedo hacer?",
+    "¿Qué es el permiso por protección temporal?",
+]
+
+
+def create_database(path):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", DEEPSEEK_API_KEY="sk-test")
+    code = "from app import create_app\nfrom extensions import db\napp = create_app()\nwith app.app_context(): db.create_all()"
+    subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, env=env, check=True)
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/", timeout=1)
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not start")
+
+
+def post_chat(base_url, index):
+    status, _, seconds = post_json(base_url + "/api/chat", {"message": f"{MESSAGES[index % len(MESSAGES)]} (#{index})"})
+    return status, seconds
+
+
+def run(worker_class, args, llm_url, fake_server):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    db_path = os.path.join(tempfile.mkdtemp(prefix='load_chat_'), 'bench.db')
+    create_database(db_path)
+
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{db_path}",
+        DEEPSEEK_BASE_URL=llm_url,
+        DEEPSEEK_API_KEY="sk-test",
+        WEB_SEARCH_ENABLED="0",
+        RESPONSE_CACHE_ENABLED="0",
+        # Every request comes from one IP; measure serving capacity, not the per-user limits
+        USER_BURST="1000000",
+        ADMISSION_USER_QUEUE="1000000",
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_WORKERS=str(args.workers),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_up(base_url)
+        fake_server.stats["max_in_flight"] = 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda i: post_chat(base_url, i), range(args.requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    latencies = [seconds for status, seconds in results if status == 200]
+    return {
+        "workerClass": worker_class,
+        "workers": args.workers,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "llmLatency": args.latency,
+        "ok": len(latencies),
+        "errors": len(results) - len(latencies),
+        "seconds": round(elapsed, 2),
+        "throughput": round(len(latencies) / elapsed, 2),
+        "p50": round(percentile(latencies, 0.5) or 0, 3),
+        "p95": round(percentile(latencies, 0.95) or 0, 3),
+        "maxLlmInFlight": fake_server.stats["max_in_flight"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=2.0, help="Simulated LLM latency in seconds")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-class', nargs='+', default=['sync', 'gevent'])
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    fake_server, llm_url = start_server(latency=args.latency)
+    results = []
+    for worker_class in args.worker_class:
+        result = run(worker_class, args, llm_url, fake_server)
+        results.append(result)
+        print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    fake_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,10 @@ class Config:
     db_host = os.getenv('DB_HOST')
     db_name = os.getenv('DB_NAME')
 
-    if db_user and db_host and db_name:
+    if os.getenv('DATABASE_URL'):
+        # Explicit URL wins (benchmarks, tests, other deployments)
+        SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
+    elif db_user and db_host and db_name:
         SQLALCHEMY_DATABASE_URI = f"mysql+pymysql://{db_user}:{db_password or ''}@{db_host}/{db_name}"
     else:
         # Fallback to SQLite for development/testing if MySQL vars are missing
@@ -24,3 +27,10 @@ class Config:
         "pool_pre_ping": True,
         "pool_recycle": 300,
     }
+    if SQLALCHEMY_DATABASE_URI != 'sqlite://' and ':memory:' not in SQLALCHEMY_DATABASE_URI:
+        # With gevent workers one process serves many requests at once, size the pool accordingly
+        SQLALCHEMY_ENGINE_OPTIONS.update({
+            "pool_size": int(os.getenv('DB_POOL_SIZE', '10')),
+            "max_overflow": int(os.getenv('DB_MAX_OVERFLOW', '20')),
+            "pool_timeout": int(os.getenv('DB_POOL_TIMEOUT', '30')),
+        })
@@ -0,0 +1,61 @@
+import os
+
+# Gunicorn settings, read automatically from the working directory.
+#
+# The default worker is gevent: /api/chat spends almost all of its time waiting on the LLM,
+# so cooperative workers let one process keep hundreds of requests in flight instead of one.
+# Set GUNICORN_WORKER_CLASS=sync to go back to the classic blocking workers.
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+# Max simultaneous requests per gevent worker
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '500'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+wsgi_app = 'app:create_app()'
+
+# Workers share their /metrics values through this directory (see services/metrics.py)
+metrics_dir = os.environ.setdefault('METRICS_DIR', '/tmp/iuristatech-metrics')
+
+
+def on_starting(server):
+    # Counters start from zero with every server start
+    import shutil
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    # No worker is running ingestion jobs yet: the ones left 'running' were interrupted. In a subprocess so
+    # the master never imports the app (the gevent workers must patch the stdlib before it is imported)
+    import sys
+    import subprocess
+    subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recover_jobs.py')], check=False)
+
+
+def post_worker_init(worker):
+    # Jobs accepted by a worker that was restarted before running them
+    from services.ingestion import resume_queued_jobs
+    resume_queued_jobs(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    from services.metrics import registry
+    registry.flush(force=True)
+
+
+def child_exit(server, worker):
+    # Runs in the master once the worker is gone: keep its counters, drop its file and gauges. In a
+    # subprocess for the same reason as on_starting: workers forked later must not inherit the module
+    import sys
+    import subprocess
+    subprocess.run([sys.executable, '-c', f'from services.metrics import retire_worker; retire_worker({worker.pid})'],
+                   cwd=os.path.dirname(os.path.abspath(__file__)), check=False)
+
+
+def post_fork(server, worker):
+    # Runs before the gevent worker monkey-patches the stdlib. trio (an optional backend the HTTP client
+    # probes for at import time) builds its epoll loop on import, which fails once select is patched.
+    if worker_class == 'gevent':
+        try:
+            import trio  # noqa: F401
+        except ImportError:
+            pass
@@ -0,0 +1,247 @@
+"""Versioned schema migrations for MySQL and SQLite.
+
+Applies, in order, the migrations not yet recorded in schema_migrations. Every step checks the live schema
+before changing it (column or index already there -> skipped), so a migration interrupted halfway, or run
+against a database created by create_all/schema.sql, can simply be run again.
+
+    python migrate.py            # apply pending migrations, with EXPLAIN of the hot queries before and after
+    python migrate.py --status   # applied and pending versions
+    python migrate.py --explain  # current query plans only
+"""
+import sys
+import time
+import argparse
+from datetime import datetime
+from sqlalchemy import inspect, text
+from app import create_app
+from extensions import db
+
+
+def create_tables():
+    # Only creates missing tables (with their columns and indexes); existing ones are left alone
+    db.create_all()
+
+
+def add_column(table, column, ddl):
+    """Step that adds `column` unless it exists. Calling it returns True if the column was added."""
+    def step():
+        if column in {c['name'] for c in inspect(db.engine).get_columns(table)}:
+            return False
+        with db.engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        print(f"  added {table}.{column}")
+        return True
+    return step
+
+
+def create_index(name, table, columns, unique=False):
+    """Step that creates the index unless one (or a unique constraint) already covers exactly `columns`."""
+    def step():
+        inspector = inspect(db.engine)
+        existing = [ix['column_names'] for ix in inspector.get_indexes(table)]
+        existing += [uc['column_names'] for uc in inspector.get_unique_constraints(table)]
+        if list(columns) in existing:
+            return False
+        with db.engine.begin() as conn:
+            conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({', '.join(columns)})"))
+        print(f"  created index {name} on {table} ({', '.join(columns)})")
+        return True
+    return step
+
+
+def add_approval_column():
+    # Users that existed before approvals were introduced stay able to log in
+    if add_column('users', 'is_approved', 'BOOLEAN DEFAULT FALSE')():
+        with db.engine.begin() as conn:
+            conn.execute(text("UPDATE users SET is_approved = 1"))
+
+
+def index_knowledge_base():
+    from models import KnowledgeBase, KnowledgeChunk
+    from services.knowledge_index import index_document, bump_kb_version
+
+    indexed_ids = {row[0] for row in db.session.query(KnowledgeChunk.kb_id).distinct()}
+    # Columns, not entities: the model may already map columns that later migrations add
+    for item in db.session.query(KnowledgeBase.id, KnowledgeBase.title, KnowledgeBase.content).all():
+        if item.id in indexed_ids:
+            continue
+        passages = index_document(item)
+        bump_kb_version()
+        db.session.commit()
+        print(f"  indexed '{item.title}' ({passages} passages)")
+
+
+def backfill_conversation_activity():
+    from services.conversations import backfill
+    print(f"  backfilled {backfill()} conversations")
+
+
+def reconcile_stats():
+    from services.stats import reconcile
+    reconcile()
+
+
+def backfill_content_previews(batch_size=20):
+    """Fills the stored previews of documents ingested before they existed, a few documents at a time."""
+    from models import KnowledgeBase, UploadedDocument
+    from services.knowledge_index import kb_content_fields
+    from services.documents import DOCUMENT_PREVIEW_CHARS
+
+    for model, missing, fields in (
+        (KnowledgeBase, KnowledgeBase.char_count.is_(None), kb_content_fields),
+        (UploadedDocument, UploadedDocument.preview.is_(None), lambda content: {"preview": content[:DOCUMENT_PREVIEW_CHARS]}),
+    ):
+        updated, last_id = 0, 0
+        while True:
+            rows = db.session.query(model.id, model.content).filter(missing, model.id > last_id).order_by(
+                model.id).limit(batch_size).all()
+            if not rows:
+                break
+            for row in rows:
+                db.session.query(model).filter(model.id == row.id).update(fields(row.content), synchronize_session=False)
+            db.session.commit()
+            updated += len(rows)
+            last_id = rows[-1].id
+        print(f"  backfilled {updated} {model.__tablename__} rows")
+
+
+MIGRATIONS = [
+    (1, "Base tables", [create_tables]),
+    (2, "User admin and approval flags", [
+        add_column('users', 'is_admin', 'BOOLEAN DEFAULT FALSE'),
+        add_approval_column,
+    ]),
+    (3, "Conversation summaries", [
+        add_column('conversations', 'summary', 'TEXT'),
+        add_column('conversations', 'summary_message_id', 'INTEGER DEFAULT 0'),
+    ]),
+    (4, "Knowledge base passage index", [index_knowledge_base]),
+    (5, "Message idempotency keys", [
+        add_column('messages', 'idempotency_key', 'VARCHAR(64)'),
+        create_index('uq_messages_idempotency_key', 'messages', ['idempotency_key'], unique=True),
+    ]),
+    (6, "Conversation activity columns", [
+        add_column('conversations', 'last_message_at', 'DATETIME'),
+        add_column('conversations', 'message_count', 'INTEGER NOT NULL DEFAULT 0'),
+        add_column('conversations', 'last_message_preview', 'VARCHAR(255)'),
+        backfill_conversation_activity,
+    ]),
+    (7, "Dashboard stats", [reconcile_stats]),
+    (8, "Indexes for history, listings and activity stats", [
+        create_index('ix_messages_conversation_created', 'messages', ['conversation_id', 'created_at']),
+        create_index('ix_messages_created_at', 'messages', ['created_at']),
+        create_index('ix_conversations_user_last_message', 'conversations', ['user_id', 'last_message_at']),
+        create_index('ix_conversations_last_message_at', 'conversations', ['last_message_at']),
+    ]),
+    (9, "Stored previews for knowledge base and uploaded documents", [
+        add_column('knowledge_base', 'preview', 'VARCHAR(255)'),
+        add_column('knowledge_base', 'char_count', 'INTEGER'),
+        add_column('knowledge_base', 'content_hash', 'VARCHAR(64)'),
+        add_column('documents', 'preview', 'TEXT'),
+        backfill_content_previews,
+    ]),
+    (10, "Chat turn leases and stored reply status", [
+        add_column('messages', 'processing_started_at', 'DATETIME'),
+        add_column('messages', 'status', 'VARCHAR(20)'),
+        add_column('messages', 'suggested_actions', 'TEXT'),
+    ]),
+]
+
+# The queries behind the chat history, the listings and the stats job, as the app issues them
+EXPLAIN_QUERIES = {
+    "chat_history": "SELECT id, sender_role, content, created_at FROM messages WHERE conversation_id = :conversation_id "
+                    "AND id > 0 AND id < 2147483647 ORDER BY created_at DESC, id DESC LIMIT 40",
+    "messages_page": "SELECT id, sender_role, content, created_at FROM messages WHERE conversation_id = :conversation_id "
+                     "ORDER BY created_at DESC, id DESC LIMIT 51",
+    "user_conversations": "SELECT id, title, last_message_at FROM conversations WHERE user_id = :user_id "
+                          "ORDER BY last_message_at DESC, id DESC LIMIT 51",
+    "admin_recent_conversations": "SELECT conversations.id, users.email FROM conversations "
+                                  "LEFT OUTER JOIN users ON users.id = conversations.user_id "
+                                  "ORDER BY conversations.last_message_at DESC, conversations.id DESC LIMIT 50",
+    "activity_window": "SELECT messages.created_at, conversations.user_id FROM messages "
+                       "JOIN conversations ON conversations.id = messages.conversation_id WHERE messages.created_at >= :since",
+}
+
+
+def explain_plans():
+    """{query: [plan lines]}; a query that cannot run yet (missing column) reports the error instead."""
+    prefix = "EXPLAIN QUERY PLAN " if db.engine.dialect.name == 'sqlite' else "EXPLAIN "
+    plans = {}
+    with db.engine.connect() as conn:
+        try:
+            sample = conn.execute(text("SELECT id, user_id FROM conversations WHERE user_id IS NOT NULL LIMIT 1")).first()
+        except Exception:
+            sample = None
+        params = {"conversation_id": sample[0] if sample else 1, "user_id": sample[1] if sample else 1,
+                  "since": datetime(2000, 1, 1)}
+        for name, sql in EXPLAIN_QUERIES.items():
+            try:
+                rows = conn.execute(text(prefix + sql), params).fetchall()
+                plans[name] = [" | ".join(str(value) for value in row) for row in rows]
+            except Exception as e:
+                plans[name] = [f"error: {str(e).splitlines()[0]}"]
+                conn.rollback()
+    return plans
+
+
+def print_plans(plans, before=None):
+    for name, lines in plans.items():
+        print(f"\n{name}")
+        if before is not None:
+            for line in before.get(name, []):
+                print(f"  before: {line}")
+        for line in lines:
+            print(f"  {'after:  ' if before is not None else ''}{line}")
+
+
+def applied_versions():
+    from models import SchemaMigration
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    return {row.version for row in db.session.query(SchemaMigration.version)}
+
+
+def migrate():
+    from models import SchemaMigration
+
+    applied = applied_versions()
+    pending = [m for m in MIGRATIONS if m[0] not in applied]
+    if not pending:
+        print("Database schema is up to date.")
+        return
+    before = explain_plans()
+    for version, name, steps in pending:
+        print(f"Applying {version}: {name}...")
+        started = time.perf_counter()
+        for step in steps:
+            step()
+        db.session.add(SchemaMigration(version=version, name=name, applied_at=datetime.utcnow()))
+        db.session.commit()
+        print(f"  done in {time.perf_counter() - started:.1f}s")
+    print("\nQuery plans before and after:")
+    print_plans(explain_plans(), before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--status', action='store_true', help="List applied and pending migrations")
+    parser.add_argument('--explain', action='store_true', help="Print the current query plans and exit")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        try:
+            if args.explain:
+                print_plans(explain_plans())
+            elif args.status:
+                applied = applied_versions()
+                for version, name, _ in MIGRATIONS:
+                    print(f"{version:>3} {'applied' if version in applied else 'pending'}  {name}")
+            else:
+                migrate()
+        except Exception as e:
+            print(f"Migration error: {e}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -22,22 +22,126 @@ class Conversation(db.Model):
     status = db.Column(db.Enum('active', 'archived', 'risk_detected'), default='active')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    summary = db.Column(db.Text) # Rolling summary of the turns that no longer fit the history budget
+    summary_message_id = db.Column(db.Integer, default=0) # Last message folded into the summary
+    # Maintained on every message insert (services/conversations.record_message), so listings need no join on messages
+    last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    last_message_preview = db.Column(db.String(255))
     
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index('ix_conversations_user_last_message', 'user_id', 'last_message_at'), # User listing and profile
+        db.Index('ix_conversations_last_message_at', 'last_message_at'), # Admin recent conversations
+    )
+
 class Message(db.Model):
     __tablename__ = 'messages'
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
     sender_role = db.Column(db.Enum('user', 'assistant', 'system'), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    content = db.deferred(db.Column(db.Text, nullable=False)) # Loaded on access; listings query the columns they show
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    idempotency_key = db.Column(db.String(64), unique=True) # sha256 of the requesting user + client key of a user turn, dedupes retries
+    processing_started_at = db.Column(db.DateTime) # User turn: lease of the request generating its reply, cleared once stored
+    status = db.Column(db.String(20)) # Assistant reply: detected status, returned again when a retried turn is replayed
+    suggested_actions = db.Column(db.Text) # Assistant reply: JSON list of the suggested actions
+
+    __table_args__ = (
+        db.Index('ix_messages_conversation_created', 'conversation_id', 'created_at'), # History and message pages
+        db.Index('ix_messages_created_at', 'created_at'), # Activity stats window
+    )
 
 class KnowledgeBase(db.Model):
     __tablename__ = 'knowledge_base'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
-    content = db.Column(db.Text, nullable=False) # Extracted text
+    content = db.deferred(db.Column(db.Text, nullable=False)) # Extracted text, can be megabytes: loaded on access only
     file_type = db.Column(db.String(50)) # pdf, docx
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Filled at ingest (services/knowledge_index.kb_content_fields) so listings never read content
+    preview = db.Column(db.String(255))
+    char_count = db.Column(db.Integer)
+    content_hash = db.Column(db.String(64)) # sha256 of the extracted text
+
+
+class KnowledgeChunk(db.Model):
+    __tablename__ = 'knowledge_chunks'
+    id = db.Column(db.Integer, primary_key=True)
+    kb_id = db.Column(db.Integer, db.ForeignKey('knowledge_base.id', ondelete='CASCADE'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    length = db.Column(db.Integer, nullable=False) # Number of indexed terms (BM25 doc length)
+
+class KnowledgeTerm(db.Model):
+    __tablename__ = 'knowledge_terms'
+    # Inverted index: one posting per (term, chunk)
+    term = db.Column(db.String(64), primary_key=True)
+    chunk_id = db.Column(db.Integer, db.ForeignKey('knowledge_chunks.id', ondelete='CASCADE'), primary_key=True, index=True)
+    tf = db.Column(db.Integer, nullable=False)
+
+class KnowledgeBaseVersion(db.Model):
+    __tablename__ = 'knowledge_base_version'
+    # Single row bumped on every KB change so each worker can invalidate its caches cheaply
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ResponseCache(db.Model):
+    __tablename__ = 'response_cache'
+    id = db.Column(db.Integer, primary_key=True)
+    cache_key = db.Column(db.String(64), unique=True, nullable=False) # sha256(message, model, kb version, prompt)
+    response_text = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    suggested_actions = db.Column(db.Text) # JSON list
+    hits = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class IngestionJob(db.Model):
+    __tablename__ = 'ingestion_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(512), nullable=False) # Stored upload, removed once processed
+    status = db.Column(db.Enum('queued', 'running', 'done', 'failed'), default='queued')
+    pages_total = db.Column(db.Integer)
+    pages_done = db.Column(db.Integer, default=0)
+    characters = db.Column(db.Integer)
+    kb_id = db.Column(db.Integer, db.ForeignKey('knowledge_base.id', ondelete='SET NULL'), nullable=True)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class UploadedDocument(db.Model):
+    __tablename__ = 'documents'
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), unique=True, nullable=False) # sha256 of the uploaded file
+    filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(50))
+    content = db.deferred(db.Column(db.Text(4294967295), nullable=False)) # Extracted text (LONGTEXT on MySQL), loaded on access
+    preview = db.Column(db.Text) # First DOCUMENT_PREVIEW_CHARS of content, stored at upload
+    characters = db.Column(db.Integer)
+    pages = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StatCounter(db.Model):
+    __tablename__ = 'stat_counters'
+    # Dashboard totals kept up to date by the write paths (services/stats.py), so /api/admin/stats never counts tables
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ActivityBucket(db.Model):
+    __tablename__ = 'activity_hourly'
+    # Messages per user and hour; rolling-window metrics add up the last buckets. user_id 0 = anonymous chats
+    hour = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    messages = db.Column(db.Integer, nullable=False, default=0)
 
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    # One row per migration applied by migrate.py
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(255), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,17 @@
+from app import create_app
+from services.stats import reconcile
+
+# Recounts the dashboard stats from users/conversations/messages to correct any drift.
+# Schedule it (e.g. hourly from cron); the tables themselves are created by migrate.py.
+app = create_app()
+
+with app.app_context():
+    print("Reconciling dashboard stats...")
+    try:
+        drift = reconcile()
+        if drift:
+            print(f"Corrected drift: {drift}")
+        print("Dashboard stats are up to date.")
+
+    except Exception as e:
+        print(f"Reconciliation error: {e}")
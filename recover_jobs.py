@@ -0,0 +1,15 @@
+from app import create_app
+from services.ingestion import recover_interrupted_jobs
+
+# Marks the knowledge base ingestion jobs interrupted by a server stop as failed, so clients polling
+# /api/admin/knowledge/jobs/<id> get a final state. gunicorn.conf.py runs it on every server start,
+# before the workers (which then resume the jobs still queued).
+app = create_app()
+
+with app.app_context():
+    try:
+        failed = recover_interrupted_jobs()
+        if failed:
+            print(f"Marked {failed} interrupted ingestion jobs as failed.")
+    except Exception as e:
+        print(f"Ingestion job recovery error: {e}")
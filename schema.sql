@@ -27,7 +27,14 @@ CREATE TABLE IF NOT EXISTS conversations (
     status ENUM('active', 'archived', 'risk_detected') DEFAULT 'active',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+    summary TEXT, -- Rolling summary of the turns that no longer fit the history budget
+    summary_message_id INT DEFAULT 0,
+    last_message_at DATETIME DEFAULT CURRENT_TIMESTAMP, -- Maintained on every message insert
+    message_count INT NOT NULL DEFAULT 0,
+    last_message_preview VARCHAR(255),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL,
+    INDEX ix_conversations_user_last_message (user_id, last_message_at),
+    INDEX ix_conversations_last_message_at (last_message_at)
 );
 
 -- 3. Messages Table
@@ -38,9 +45,19 @@ CREATE TABLE IF NOT EXISTS messages (
     sender_role ENUM('user', 'assistant', 'system') NOT NULL,
     content TEXT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+    idempotency_key VARCHAR(64), -- sha256 of the requesting user + client key of a user turn
+    processing_started_at DATETIME, -- User turn: lease of the request generating its reply
+    status VARCHAR(20), -- Assistant reply: detected status
+    suggested_actions TEXT, -- Assistant reply: JSON list of suggested actions
+    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
+    UNIQUE INDEX uq_messages_idempotency_key (idempotency_key),
+    INDEX ix_messages_conversation_created (conversation_id, created_at),
+    INDEX ix_messages_created_at (created_at)
 );
 
+-- The remaining tables (knowledge base, caches, stats...) and any later change are created by
+-- `python migrate.py`, which also brings databases created from an older version of this file up to date.
+
 -- 4. Initial Seed Data (Optional)
 -- Client user (password: '123456') - Hash in real app
 INSERT INTO users (email, password_hash, full_name, role) 
@@ -0,0 +1,179 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict, deque
+from services import metrics
+
+# Limits are per worker process: with gunicorn multiply by the number of workers
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', '64'))
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '128'))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '15'))
+# Waiting requests a single user may have, so one client cannot fill the queue
+ADMISSION_USER_QUEUE = int(os.getenv('ADMISSION_USER_QUEUE', '4'))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '5'))
+
+# Per-user token bucket: sustained rate and burst size
+USER_RATE_PER_MINUTE = float(os.getenv('USER_RATE_PER_MINUTE', '20'))
+USER_BURST = float(os.getenv('USER_BURST', '5'))
+MAX_TRACKED_USERS = int(os.getenv('ADMISSION_MAX_TRACKED_USERS', '10000'))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code, message, retry_after, reason):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBuckets:
+    def __init__(self, rate_per_second, burst):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.buckets = OrderedDict() # user_key -> (tokens, updated_at)
+        self.lock = threading.Lock()
+
+    def take(self, user_key):
+        """Consume one token. Returns 0 if allowed, or the seconds until a token is available."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at = self.buckets.pop(user_key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            self.buckets[user_key] = (tokens, now)
+            while len(self.buckets) > MAX_TRACKED_USERS:
+                self.buckets.popitem(last=False) # Least recently seen user
+            return wait
+
+
+class Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """Global concurrency cap with a bounded wait queue served round-robin across users."""
+
+    def __init__(self, max_concurrent, queue_size, queue_timeout, user_queue):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.user_queue = user_queue
+        self.active = 0
+        self.queued = 0
+        self.queues = OrderedDict() # user_key -> deque of Waiters, in round-robin order
+        self.lock = threading.Lock()
+        self.stats = {"admitted": 0, "rejected_rate_limited": 0, "rejected_queue_full": 0, "rejected_timeout": 0,
+                      "queued_total": 0, "queued_admitted": 0, "max_queue_depth": 0, "wait_seconds_total": 0.0, "max_wait_seconds": 0.0}
+
+    def acquire(self, user_key):
+        with self.lock:
+            if self.active < self.max_concurrent and not self.queued:
+                self.active += 1
+                self.stats["admitted"] += 1
+                return 0.0
+            if self.queued >= self.queue_size:
+                self.stats["rejected_queue_full"] += 1
+                metrics.admission_rejected.inc(reason='queue_full')
+                raise AdmissionRejected(503, "El servicio está saturado, intenta de nuevo en unos segundos",
+                                        ADMISSION_RETRY_AFTER, "queue_full")
+            user_waiters = self.queues.setdefault(user_key, deque())
+            if len(user_waiters) >= self.user_queue:
+                self.stats["rejected_rate_limited"] += 1
+                metrics.admission_rejected.inc(reason='user_queue')
+                raise AdmissionRejected(429, "Tienes demasiadas consultas en espera", ADMISSION_RETRY_AFTER, "user_queue")
+            waiter = Waiter()
+            user_waiters.append(waiter)
+            self.queued += 1
+            self.stats["queued_total"] += 1
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.queued)
+
+        started = time.monotonic()
+        waiter.event.wait(self.queue_timeout)
+        waited = time.monotonic() - started
+        with self.lock:
+            if not waiter.granted:
+                # Timed out: leave the queue (a grant can't race us, it happens under this lock)
+                user_waiters = self.queues.get(user_key)
+                if user_waiters is not None:
+                    user_waiters.remove(waiter)
+                    if not user_waiters:
+                        del self.queues[user_key]
+                self.queued -= 1
+                self.stats["rejected_timeout"] += 1
+                metrics.admission_rejected.inc(reason='queue_timeout')
+                raise AdmissionRejected(503, "El servicio está saturado, intenta de nuevo en unos segundos",
+                                        ADMISSION_RETRY_AFTER, "queue_timeout")
+            self.stats["admitted"] += 1
+            self.stats["queued_admitted"] += 1
+            self.stats["wait_seconds_total"] += waited
+            self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+        metrics.admission_wait.observe(waited)
+        return waited
+
+    def release(self):
+        with self.lock:
+            if not self.queues:
+                self.active -= 1
+                return
+            # Hand the slot to the next user in round-robin order, that user goes to the back
+            user_key, user_waiters = next(iter(self.queues.items()))
+            waiter = user_waiters.popleft()
+            if user_waiters:
+                self.queues.move_to_end(user_key)
+            else:
+                del self.queues[user_key]
+            self.queued -= 1
+            waiter.granted = True
+            waiter.event.set()
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats, active=self.active, queue_depth=self.queued, waiting_users=len(self.queues),
+                         max_concurrent=self.max_concurrent, queue_size=self.queue_size)
+        queued_admitted = stats["queued_admitted"]
+        stats["avg_wait_seconds"] = round(stats["wait_seconds_total"] / queued_admitted, 4) if queued_admitted else 0
+        return stats
+
+
+controller = AdmissionController(ADMISSION_MAX_CONCURRENT, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT, ADMISSION_USER_QUEUE)
+user_buckets = TokenBuckets(USER_RATE_PER_MINUTE / 60, USER_BURST)
+
+
+def check_rate(user_key):
+    wait = user_buckets.take(user_key)
+    if wait:
+        with controller.lock:
+            controller.stats["rejected_rate_limited"] += 1
+        metrics.admission_rejected.inc(reason='rate_limited')
+        raise AdmissionRejected(429, "Has enviado demasiadas consultas, espera un momento", math.ceil(wait), "rate_limited")
+
+
+def acquire(user_key):
+    """Aplica el límite por usuario y espera un turno en la cola global. Lanza AdmissionRejected.
+
+    Cada acquire() exitoso debe terminar con un release().
+    """
+    check_rate(user_key)
+    return controller.acquire(user_key)
+
+
+def release():
+    controller.release()
+
+
+def get_admission_stats():
+    return controller.snapshot()
+
+
+def collect_metrics():
+    with controller.lock:
+        metrics.admission_active.set(controller.active)
+        metrics.admission_queue_depth.set(controller.queued)
+
+
+metrics.registry.add_collector(collect_metrics)
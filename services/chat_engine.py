@@ -1,21 +1,18 @@
 import os
-import openai
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from duckduckgo_search import DDGS
+from services.llm_gateway import chat_completion, has_providers, primary_model, primary_provider, LLMUnavailableError
+from services import metrics
 
 load_dotenv()
 
-# Initialize OpenAI client (DeepSeek Compatible)
-api_key = os.getenv("DEEPSEEK_API_KEY") # Prioritize DeepSeek
-if not api_key:
-    api_key = os.getenv("OPENAI_API_KEY")
-    BASE_URL = None
-    MODEL_NAME = "gpt-3.5-turbo"
-else:
-    BASE_URL = "https://api.deepseek.com"
-    MODEL_NAME = "deepseek-chat"
-
-client = openai.OpenAI(api_key=api_key, base_url=BASE_URL)
+# LLM calls go through services.llm_gateway (DeepSeek first, OpenAI as failover when configured)
+MODEL_NAME = primary_model()
 
 SYSTEM_PROMPT = """
 Eres 'IuristaTech AI', un asistente legal virtual experto en derecho colombiano.
@@ -50,40 +47,331 @@ Ejemplos:
 [ACCION: Contactar Abogado]
 """
 
+SYNTHESIS_INSTRUCTIONS = "\n\nINSTRUCCIÓN DE SÍNTESIS: Para responder, DEBES integrar estas tres fuentes:\n1. TUS ARCHIVOS (Base de Conocimiento): Prioridad máxima para datos específicos del usuario.\n2. BÚSQUEDA WEB: Úsala para actualizar leyes o confirmar hechos recientes.\n3. TU CONOCIMIENTO: Úsalo para explicar conceptos, dar estructura y sentido legal.\n\nCombina todo para dar la respuesta más completa y precisa posible."
+
+# 'stable' keeps a byte-identical prompt prefix across requests (provider-side context caching);
+# 'inline' is the original single system message with per-request content in the middle
+PROMPT_LAYOUT = os.getenv('PROMPT_LAYOUT', 'stable')
+
+# Changes whenever the fixed prompt text changes, so cached answers from an older prompt are not reused
+PROMPT_HASH = hashlib.sha256((PROMPT_LAYOUT + SYSTEM_PROMPT + SYNTHESIS_INSTRUCTIONS).encode('utf-8')).hexdigest()[:16]
+
+# Process-level cache of the assembled KB prompt block, invalidated by the KB version row
+KB_CACHE_SIZE = int(os.getenv('KB_CACHE_SIZE', '256'))
+# Titles listed in the stable system prefix (0 leaves the catalog out). The oldest ones, so the prefix stops
+# changing with every upload once the list is full
+KB_CATALOG_MAX_TITLES = int(os.getenv('KB_CATALOG_MAX_TITLES', '30'))
+_kb_cache = {"version": None, "stats": None, "catalog": None, "blocks": OrderedDict()}
+_kb_cache_lock = threading.Lock()
+
+def get_kb_block(message, version):
+    """Bloque de contexto de la base de conocimiento para la pregunta, cacheado por versión de KB."""
+    from services.knowledge_index import KB_TOKEN_BUDGET, corpus_stats, search_knowledge
+    from services.retrieval import tokenize, estimate_tokens
+
+    key = " ".join(sorted(set(tokenize(message))))
+    token_budget = KB_TOKEN_BUDGET
+    if PROMPT_LAYOUT == 'stable':
+        # The catalog goes to the system prefix of every turn: its tokens come out of the KB budget
+        token_budget = max(1, KB_TOKEN_BUDGET - estimate_tokens(get_kb_catalog(version)))
+
+    with _kb_cache_lock:
+        if _kb_cache["version"] != version:
+            _kb_cache.update(version=version, stats=None, catalog=None, blocks=OrderedDict())
+        blocks = _kb_cache["blocks"]
+        if key in blocks:
+            blocks.move_to_end(key)
+            return blocks[key]
+        stats = _kb_cache["stats"]
+
+    if stats is None:
+        stats = corpus_stats()
+
+    block = ""
+    passages = search_knowledge(message, token_budget=token_budget, stats=stats)
+    if passages:
+        context_text = "\n\n".join([f"--- DOCUMENTO REFERENCIA: {p['title']} (fragmento {p['position'] + 1}) ---\n{p['content']}" for p in passages])
+        block = f"\n\n5. BASE DE CONOCIMIENTO (FUENTE PRIMARIA Y OBLIGATORIA):\n{context_text}\n\nINSTRUCCIÓN CRÍTICA: La respuesta DEBE basarse principalmente en los documentos anteriores. Si la información está en estos documentos, úsala y cítala explícitamente. Ignora tu conocimiento general si contradice estos documentos."
+
+    with _kb_cache_lock:
+        if _kb_cache["version"] == version:
+            _kb_cache["stats"] = stats
+            blocks = _kb_cache["blocks"]
+            blocks[key] = block
+            while len(blocks) > KB_CACHE_SIZE:
+                blocks.popitem(last=False)
+    return block
+
+# Context gathering (KB, web search, history) runs concurrently. KB and history are always waited for; web
+# search has its own pool and deadline, so slow searches can neither crowd out nor delay the other stages
+_context_pool = ThreadPoolExecutor(max_workers=int(os.getenv('CONTEXT_WORKERS', '16')), thread_name_prefix='chat-context')
+SEARCH_DEADLINE_SECONDS = float(os.getenv('SEARCH_DEADLINE_SECONDS', os.getenv('CONTEXT_DEADLINE_SECONDS', '3.0')))
+_search_pool = ThreadPoolExecutor(max_workers=int(os.getenv('SEARCH_WORKERS', '16')), thread_name_prefix='chat-search')
+
+def gather_context(stages, timings, optional_stages=None, deadline=None):
+    """Ejecuta las etapas {nombre: función} en paralelo y devuelve {nombre: resultado}.
+
+    Las etapas de `stages` siempre se esperan. Las de `optional_stages` corren en su propio pool y, si no terminan
+    antes del plazo, se descartan (no aparecen en el resultado) y quedan registradas en `timings` como 'timeout'.
+    Las funciones corren con el contexto de la app.
+    """
+    from flask import current_app
+    app = current_app._get_current_object()
+    deadline = SEARCH_DEADLINE_SECONDS if deadline is None else deadline
+
+    def run(fn):
+        started = time.perf_counter()
+        with app.app_context():
+            value = fn()
+        return value, round(time.perf_counter() - started, 4)
+
+    optional = {_search_pool.submit(run, fn): name for name, fn in (optional_stages or {}).items()}
+    required = {_context_pool.submit(run, fn): name for name, fn in stages.items()}
+    started = time.perf_counter()
+    wait(required)
+    done, pending = wait(optional, timeout=max(0, deadline - (time.perf_counter() - started)))
+
+    results = {}
+    futures = {**required, **optional}
+    for future in set(required) | done:
+        name = futures[future]
+        try:
+            results[name], timings[name] = future.result()
+        except Exception as e:
+            timings[name] = 'error'
+            print(f"Error in context stage '{name}': {e}")
+    for future in pending:
+        future.cancel() # Still queued behind other searches: do not run it at all
+        name = futures[future]
+        timings[name] = 'timeout'
+        print(f"Context stage '{name}' missed the {deadline}s deadline, dropping it")
+    return results
+
+def fetch_search_results(query):
+    results = DDGS().text(f"colombia derecho legal {query}", max_results=3) or []
+    return [{"title": r['title'], "body": r['body'], "href": r['href']} for r in results]
+
+def get_kb_catalog(version):
+    """Bloque fijo con los primeros KB_CATALOG_MAX_TITLES títulos de la KB; solo cambia cuando cambia la versión de la KB."""
+    from extensions import db
+    from models import KnowledgeBase
+    with _kb_cache_lock:
+        if _kb_cache["version"] != version:
+            _kb_cache.update(version=version, stats=None, catalog=None, blocks=OrderedDict())
+        catalog = _kb_cache["catalog"]
+    if catalog is not None:
+        return catalog
+
+    catalog = ""
+    titles = []
+    if KB_CATALOG_MAX_TITLES > 0:
+        titles = [row.title for row in db.session.query(KnowledgeBase.title).order_by(KnowledgeBase.id).limit(KB_CATALOG_MAX_TITLES + 1)]
+    if titles:
+        listing = "\n".join(f"- {title}" for title in titles[:KB_CATALOG_MAX_TITLES])
+        if len(titles) > KB_CATALOG_MAX_TITLES:
+            # No count: the prefix must not change with each new document
+            listing += "\n- (y otros documentos)"
+        catalog = f"\n\nDOCUMENTOS DISPONIBLES EN LA BASE DE CONOCIMIENTO (los fragmentos relevantes se incluyen más adelante, junto a la pregunta):\n{listing}"
+
+    with _kb_cache_lock:
+        if _kb_cache["version"] == version:
+            _kb_cache["catalog"] = catalog
+    return catalog
+
+WEB_SEARCH_ENABLED = os.getenv('WEB_SEARCH_ENABLED', '1') == '1'
+
 def search_web(query):
     """Realiza una búsqueda web rápida para obtener contexto actualizado."""
+    if not WEB_SEARCH_ENABLED:
+        return ""
     try:
-        results = DDGS().text(f"colombia derecho legal {query}", max_results=3)
+        from services.search_cache import search_cache
+        results = search_cache.get_or_fetch(query, fetch_search_results)
         if not results:
             return ""
         
         search_ctx = "\n\n--- RESULTADOS DE BÚSQUEDA WEB (USAR SOLO SI ES RELEVANTE) ---\n"
-        for r in results:
-            search_ctx += f"- {r['title']}: {r['body']} (Fuente: {r['href']})\n"
+        search_ctx += "".join(f"- {r['title']}: {r['body']} (Fuente: {r['href']})\n" for r in results)
         return search_ctx
     except Exception as e:
         print(f"Error searching web: {e}")
         return ""
 
-def generate_response(message, conversation_id=None, document_context=None):
+# Long uploaded documents: only the passages relevant to the question are sent,
+# or a map-reduce summary when the user asks about the whole document
+DOC_TOKEN_BUDGET = int(os.getenv('DOC_TOKEN_BUDGET', '4000'))
+DOC_MAP_CHUNK_CHARS = int(os.getenv('DOC_MAP_CHUNK_CHARS', '24000'))
+DOC_MAP_CONCURRENCY = int(os.getenv('DOC_MAP_CONCURRENCY', '4'))
+# The summary runs inside the chat request: documents needing more map calls than this, or summaries not done
+# within the deadline, fall back to the relevant passages (well below the gunicorn timeout)
+DOC_MAP_MAX_CHUNKS = int(os.getenv('DOC_MAP_MAX_CHUNKS', '8'))
+DOC_SUMMARY_DEADLINE_SECONDS = float(os.getenv('DOC_SUMMARY_DEADLINE_SECONDS', '60'))
+# Whole-token phrases (normalized, without accents) that ask about the whole document. Bare words such as
+# "resumen" are not enough: "¿qué dice el resumen ejecutivo de la cláusula 3?" is a targeted question
+FULL_DOCUMENT_KEYWORDS = (
+    'todo el documento', 'documento completo', 'documento entero',
+    'resume el documento', 'resume este documento', 'resumir el documento', 'resumir este documento',
+    'resumen del documento', 'resumen de este documento', 'resumelo', 'resumemelo',
+    'hazme un resumen', 'haz un resumen', 'dame un resumen', 'resumen general',
+    'analiza el documento', 'analizar el documento', 'analisis completo', 'analisis del documento'
+)
+
+DOC_MAP_PROMPT = """Eres un abogado colombiano. Resume la parte del documento que recibes en español, conservando:
+partes involucradas, obligaciones, plazos, valores, cláusulas relevantes y posibles riesgos legales.
+Sé conciso y usa viñetas. No inventes información que no esté en el texto."""
+
+DOC_REDUCE_PROMPT = """Eres un abogado colombiano. Recibes resúmenes parciales de un mismo documento, en orden.
+Combínalos en un único resumen coherente que conserve partes, obligaciones, plazos, valores, cláusulas clave y riesgos."""
+
+def wants_full_document(message):
+    from services.retrieval import TOKEN_RE, normalize_text
+    normalized = f" {' '.join(TOKEN_RE.findall(normalize_text(message)))} "
+    return any(f" {keyword} " in normalized for keyword in FULL_DOCUMENT_KEYWORDS)
+
+def summarize_document(doc_name, doc_text):
+    """Map-reduce: resume cada bloque del documento en paralelo y luego combina los resúmenes.
+
+    Devuelve None si el documento necesita más de DOC_MAP_MAX_CHUNKS bloques o si el resumen no termina
+    dentro de DOC_SUMMARY_DEADLINE_SECONDS.
+    """
+    from services.retrieval import split_passages, estimate_tokens
+
+    chunks = split_passages(doc_text, max_chars=DOC_MAP_CHUNK_CHARS)
+    if len(chunks) > DOC_MAP_MAX_CHUNKS:
+        print(f"Document '{doc_name}' has {len(chunks)} parts (max {DOC_MAP_MAX_CHUNKS}), not summarizing it")
+        return None
+    deadline = time.monotonic() + DOC_SUMMARY_DEADLINE_SECONDS
+
+    def summarize(position, chunk):
+        response, _ = chat_completion(
+            messages=[
+                {"role": "system", "content": DOC_MAP_PROMPT},
+                {"role": "user", "content": f'Documento "{doc_name}", parte {position + 1} de {len(chunks)}:\n\n{chunk}'}
+            ],
+            temperature=0.2,
+        )
+        return response.choices[0].message.content
+
+    pool = ThreadPoolExecutor(max_workers=DOC_MAP_CONCURRENCY, thread_name_prefix='doc-map')
     try:
-        if not api_key or "placeholder" in api_key:
-            return {
-                "text": "Error de configuración: No se ha detectado una API Key válida (DeepSeek/OpenAI). Por favor, configure las variables de entorno.",
-                "status": "risk"
-            }
+        futures = [pool.submit(summarize, position, chunk) for position, chunk in enumerate(chunks)]
+        done, pending = wait(futures, timeout=DOC_SUMMARY_DEADLINE_SECONDS)
+        if pending:
+            print(f"Summary of '{doc_name}' missed the {DOC_SUMMARY_DEADLINE_SECONDS}s deadline")
+            return None
+        partials = [future.result() for future in futures]
+    finally:
+        # Do not wait for map calls still running after the deadline
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    combined = "\n\n".join(f"Parte {i + 1}:\n{summary}" for i, summary in enumerate(partials))
+    if estimate_tokens(combined) <= DOC_TOKEN_BUDGET:
+        return combined
+    if time.monotonic() >= deadline:
+        return None
+
+    response, _ = chat_completion(
+        messages=[{"role": "system", "content": DOC_REDUCE_PROMPT}, {"role": "user", "content": combined}],
+        temperature=0.2,
+    )
+    return response.choices[0].message.content
+
+def document_prompt_text(document_context, message, mode=None):
+    """Texto del documento a incluir en el prompt, acotado a DOC_TOKEN_BUDGET."""
+    from services.documents import get_document_index
+    from services.retrieval import estimate_tokens
 
-        detailed_system_prompt = SYSTEM_PROMPT
+    doc_text = document_context['text']
+    if estimate_tokens(doc_text) <= DOC_TOKEN_BUDGET:
+        return doc_text
 
-        # 0. Inject uploaded document context
-        if document_context:
-            doc_name = document_context.get('filename', 'Documento')
-            doc_text = document_context.get('text', '')
-            if doc_text:
-                detailed_system_prompt += f"""
+    note = "[SE INCLUYEN SOLO LOS FRAGMENTOS MÁS RELEVANTES PARA LA PREGUNTA]"
+    if mode == 'full' or wants_full_document(message):
+        summary = document_context.get('summary')
+        if summary is None:
+            summary = summarize_document(document_context.get('filename', 'Documento'), doc_text)
+            if summary is not None:
+                document_context['summary'] = summary # Cached with the conversation's document
+        if summary is not None:
+            return f"[RESUMEN DEL DOCUMENTO COMPLETO, ELABORADO POR PARTES]\n{summary}"
+        note = ("[EL DOCUMENTO ES DEMASIADO EXTENSO PARA RESUMIRLO COMPLETO: SE INCLUYEN SOLO LOS FRAGMENTOS MÁS "
+                "RELEVANTES. INDÍCALE AL USUARIO QUE EL ANÁLISIS NO CUBRE TODO EL DOCUMENTO]")
+
+    index = get_document_index(document_context)
+    passages = index.search(message, DOC_TOKEN_BUDGET)
+    total = len(index.passages)
+    fragments = "\n[...]\n".join(f"(Fragmento {position + 1} de {total})\n{text}" for position, text in passages)
+    return f"{note}\n{fragments}"
+
+# Token usage reported by the provider, accumulated per worker (cache hit/miss shows prefix caching)
+_usage_totals = {"responses": 0, "prompt_tokens": 0, "completion_tokens": 0, "cache_hit_tokens": 0, "cache_miss_tokens": 0}
+_usage_lock = threading.Lock()
+
+def record_usage(usage):
+    if usage is None:
+        return {}
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    # DeepSeek reports prompt_cache_hit/miss_tokens; OpenAI reports prompt_tokens_details.cached_tokens
+    cache_hit = getattr(usage, 'prompt_cache_hit_tokens', None)
+    cache_miss = getattr(usage, 'prompt_cache_miss_tokens', None)
+    if cache_hit is None:
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cache_hit = (getattr(details, 'cached_tokens', 0) or 0) if details else 0
+        cache_miss = prompt_tokens - cache_hit
+    result = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": getattr(usage, 'completion_tokens', 0) or 0,
+        "cache_hit_tokens": cache_hit,
+        "cache_miss_tokens": cache_miss or 0,
+    }
+    with _usage_lock:
+        _usage_totals["responses"] += 1
+        for key, value in result.items():
+            _usage_totals[key] += value
+    for key, value in result.items():
+        metrics.llm_tokens.inc(value, kind=key[:-len('_tokens')])
+    return result
+
+def get_usage_totals():
+    with _usage_lock:
+        totals = dict(_usage_totals)
+    prompt_tokens = totals["cache_hit_tokens"] + totals["cache_miss_tokens"]
+    totals["cache_hit_rate"] = round(totals["cache_hit_tokens"] / prompt_tokens, 4) if prompt_tokens else 0
+    return totals
+
+CONFIG_ERROR_RESULT = {
+    "text": "Error de configuración: No se ha detectado una API Key válida (DeepSeek/OpenAI). Por favor, configure las variables de entorno.",
+    "status": "risk"
+}
+
+ACTION_MARKER = "[ACCION:"
+
+def build_messages_payload(message, conversation_id=None, document_context=None, timings=None, token_counts=None,
+                           message_id=None):
+    """Arma los mensajes para el modelo. `token_counts`, si se pasa, recibe los tokens estimados por sección.
+
+    `message_id` es el mensaje del usuario ya guardado para este turno; se excluye del historial.
+    """
+    from services.knowledge_index import get_kb_version
+    from services.retrieval import estimate_tokens
+
+    document_block = ""
+
+    # 0. Inject uploaded document context
+    document_mode = document_context.get('mode') if document_context else None
+    if document_context and document_context.get('documentId'):
+        from services.documents import load_document
+        document_context = load_document(conversation_id, document_context['documentId'])
+        # The text is in memory now: give the connection back before the map-reduce summary calls the LLM
+        release_db_connection()
+    if document_context:
+        doc_name = document_context.get('filename', 'Documento')
+        doc_text = document_context.get('text', '')
+        if doc_text:
+            document_block = f"""
 
 --- DOCUMENTO CARGADO POR EL USUARIO: "{doc_name}" ---
-{doc_text[:15000]}
+{document_prompt_text(document_context, message, document_mode)}
 --- FIN DEL DOCUMENTO ---
 
 INSTRUCCIÓN CRÍTICA SOBRE EL DOCUMENTO:
@@ -94,77 +382,325 @@ INSTRUCCIÓN CRÍTICA SOBRE EL DOCUMENTO:
 - Cita secciones específicas del documento cuando sea relevante.
 """
 
-        # 0. Fetch Knowledge Base Context
-        try:
-            from models import KnowledgeBase
-            docs = KnowledgeBase.query.all()
-            if docs:
-                context_text = "\n\n".join([f"--- DOCUMENTO REFERENCIA: {d.title} ---\n{d.content[:5000]}..." for d in docs]) # Limit to 5k chars per doc
-                detailed_system_prompt += f"\n\n5. BASE DE CONOCIMIENTO (FUENTE PRIMARIA Y OBLIGATORIA):\n{context_text}\n\nINSTRUCCIÓN CRÍTICA: La respuesta DEBE basarse principalmente en los documentos anteriores. Si la información está en estos documentos, úsala y cítala explícitamente. Ignora tu conocimiento general si contradice estos documentos."
-        except Exception as e:
-            print(f"Error loading knowledge base: {e}")
+    # 0. Knowledge base, web search and history are gathered concurrently
+    # Read once in the request thread: every stage runs in its own app context, where g starts empty
+    kb_version = get_kb_version()
+    stages = {"kb": lambda: get_kb_block(message, kb_version)}
+    if PROMPT_LAYOUT == 'stable' and KB_CATALOG_MAX_TITLES > 0:
+        stages["kb_catalog"] = lambda: get_kb_catalog(kb_version)
+    if conversation_id:
+        from services.memory import load_history
+        stages["history"] = lambda: load_history(conversation_id, before_message_id=message_id)
+    # Only the web search may be dropped: the prompt never goes out without the KB or the history
+    context = gather_context(stages, timings if timings is not None else {},
+                             optional_stages={"search": lambda: search_web(message)})
 
-        # 1. Perform Web Search for current query
-        search_context = search_web(message)
-        if search_context:
-            detailed_system_prompt += search_context + "\nInstrucción: Usa la información de búsqueda web para complementar tu respuesta, especialmente para leyes recientes o datos actualizados."
+    kb_block = context.get("kb", "")
 
-        detailed_system_prompt += "\n\nINSTRUCCIÓN DE SÍNTESIS: Para responder, DEBES integrar estas tres fuentes:\n1. TUS ARCHIVOS (Base de Conocimiento): Prioridad máxima para datos específicos del usuario.\n2. BÚSQUEDA WEB: Úsala para actualizar leyes o confirmar hechos recientes.\n3. TU CONOCIMIENTO: Úsalo para explicar conceptos, dar estructura y sentido legal.\n\nCombina todo para dar la respuesta más completa y precisa posible."
+    # 1. Web Search for current query
+    search_context = context.get("search") or ""
+    if search_context:
+        search_context += "\nInstrucción: Usa la información de búsqueda web para complementar tu respuesta, especialmente para leyes recientes o datos actualizados."
 
+    # 2. Conversation memory: rolling summary + recent turns within HISTORY_TOKEN_BUDGET
+    history = context.get("history") or {"summary": None, "messages": []}
+    summary_block = ""
+    if history["summary"]:
+        summary_block = f"\n\nRESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{history['summary']}"
+
+    if PROMPT_LAYOUT == 'stable':
+        # Byte-stable prefix (identical for every request while the KB version is unchanged) so the
+        # provider can serve it from its context cache; per-request content goes after the history
+        messages_payload = [{"role": "system", "content": SYSTEM_PROMPT + context.get("kb_catalog", "") + SYNTHESIS_INSTRUCTIONS}]
+        if summary_block:
+            messages_payload.append({"role": "system", "content": summary_block.strip()})
+        messages_payload.extend(history["messages"])
+        volatile = (document_block + kb_block + search_context).strip()
+        if volatile:
+            messages_payload.append({"role": "system", "content": volatile})
+    else:
+        detailed_system_prompt = SYSTEM_PROMPT + document_block + kb_block + search_context + SYNTHESIS_INSTRUCTIONS + summary_block
         messages_payload = [{"role": "system", "content": detailed_system_prompt}]
-        
-        if conversation_id:
-            from models import Message
-            # Fetch last 10 messages
-            past_messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.created_at.desc()).limit(10).all()
-            past_messages.reverse()
-             
-            for msg in past_messages:
-                role = "assistant" if msg.sender_role == "assistant" else "user"
-                messages_payload.append({"role": role, "content": msg.content})
-
-        # Append current user message
-        messages_payload.append({"role": "user", "content": message})
-
-        response = client.chat.completions.create(
-            model=MODEL_NAME, 
+        messages_payload.extend(history["messages"])
+
+    # Append current user message
+    messages_payload.append({"role": "user", "content": message})
+
+    if token_counts is not None:
+        token_counts.update({
+            "system": estimate_tokens(SYSTEM_PROMPT + SYNTHESIS_INSTRUCTIONS + context.get("kb_catalog", "")),
+            "kb": estimate_tokens(kb_block) if kb_block else 0,
+            "document": estimate_tokens(document_block) if document_block else 0,
+            "search": estimate_tokens(search_context) if search_context else 0,
+            "summary": estimate_tokens(summary_block) if summary_block else 0,
+            "history": sum(estimate_tokens(m["content"]) for m in history["messages"]),
+            "message": estimate_tokens(message),
+        })
+        token_counts["total"] = sum(token_counts.values())
+    return messages_payload
+
+def observe_result(result, outcome, messages_payload=None):
+    """Exporta a /metrics los tiempos por etapa y el tamaño del prompt de un turno."""
+    metrics.chat_responses.inc(outcome=outcome)
+    for stage, value in (result.get("timings") or {}).items():
+        if isinstance(value, (int, float)):
+            metrics.chat_stage_duration.observe(value, stage=stage)
+        else:
+            metrics.chat_stage_failures.inc(stage=stage, outcome=value)
+    if messages_payload is not None:
+        result["prompt_chars"] = sum(len(m["content"]) for m in messages_payload)
+        metrics.chat_prompt_chars.observe(result["prompt_chars"])
+    if result.get("prompt_tokens"):
+        metrics.chat_prompt_tokens.observe(result["prompt_tokens"]["total"])
+
+def classify_status(ai_text):
+    status = 'analyzing'
+    if '⚠️' in ai_text or 'riesgo' in ai_text.lower():
+        status = 'risk'
+    elif 'contrato' in ai_text.lower() or 'documento' in ai_text.lower():
+        status = 'document'
+    return status
+
+def parse_ai_text(ai_text):
+    # Parse Suggested Actions
+    import re
+    suggested_actions = []
+    # Regex to find [ACCION: ...]
+    actions_found = re.findall(r'\[ACCION: (.*?)\]', ai_text)
+    if actions_found:
+        suggested_actions = actions_found
+        # Remove actions from text to keep it clean
+        ai_text = re.sub(r'\[ACCION: .*?\]', '', ai_text).strip()
+
+    return {"text": ai_text, "status": classify_status(ai_text), "suggested_actions": suggested_actions}
+
+def error_result(e):
+    print(f"OpenAI Error: {e}")
+    if isinstance(e, LLMUnavailableError) and e.last_error is not None:
+        e = e.last_error
+    if "insufficient_quota" in str(e) or "429" in str(e):
+        return {
+            "text": "⚠️ **Aviso de Sistema**: El servicio de IA está temporalmente saturado (Cuota Excedida). \n\n" + 
+                    "Sin embargo, puedo orientarle con información general: \n" +
+                    "Para temas laborales, consulte el Código Sustantivo del Trabajo. \n" +
+                    "Para temas inmobiliarios, la Ley 820 de 2003. \n" +
+                    "Le sugiero contactar directamente a nuestros abogados humanos.",
+            "status": "risk"
+        }
+
+    return {
+        "text": "Lo siento, estoy experimentando dificultades técnicas para procesar tu consulta legal en este momento. Por favor, intenta de nuevo más tarde.",
+        "status": "analyzing"
+    }
+
+def release_db_connection():
+    """Devuelve la conexión de la sesión al pool antes de esperar al modelo; se vuelve a abrir si hace falta."""
+    from extensions import db
+    db.session.close()
+
+def lookup_cached_response(message, first_turn, document_context):
+    """Para primeras preguntas sin documento devuelve (cache_key, respuesta cacheada o None)."""
+    from services.response_cache import RESPONSE_CACHE_ENABLED, response_cache_key, get_cached_response
+    from services.knowledge_index import get_kb_version
+
+    if not RESPONSE_CACHE_ENABLED or not first_turn or document_context:
+        return None, None
+    try:
+        cache_key = response_cache_key(message, MODEL_NAME, get_kb_version(), PROMPT_HASH)
+        return cache_key, get_cached_response(cache_key)
+    except Exception as e:
+        print(f"Error reading response cache: {e}")
+        return None, None
+
+def save_cached_response(cache_key, result, provider):
+    from services.response_cache import store_response
+    if provider != primary_provider():
+        return # The key names the primary model: a failover answer must not be served later as one of its answers
+    try:
+        store_response(cache_key, result)
+    except Exception as e:
+        print(f"Error writing response cache: {e}")
+
+def generate_response(message, conversation_id=None, document_context=None, first_turn=False, message_id=None):
+    try:
+        if not has_providers():
+            return dict(CONFIG_ERROR_RESULT)
+
+        # Per-stage timings in seconds, returned with the result
+        timings = {}
+        started = time.perf_counter()
+        cache_key, cached = lookup_cached_response(message, first_turn, document_context)
+        timings["response_cache"] = round(time.perf_counter() - started, 4)
+        if cached:
+            cached["timings"] = timings
+            cached["cached"] = True
+            observe_result(cached, 'cached')
+            return cached
+
+        started = time.perf_counter()
+        token_counts = {}
+        messages_payload = build_messages_payload(message, conversation_id, document_context, timings=timings,
+                                                  token_counts=token_counts, message_id=message_id)
+        timings["context"] = round(time.perf_counter() - started, 4)
+        release_db_connection()
+
+        started = time.perf_counter()
+        response, provider = chat_completion(
             messages=messages_payload,
             temperature=0.3, # Low temperature for factual accuracy
         )
+        timings["llm"] = round(time.perf_counter() - started, 4)
 
-        ai_text = response.choices[0].message.content
-        
-        # Parse Suggested Actions
-        import re
-        suggested_actions = []
-        # Regex to find [ACCION: ...]
-        actions_found = re.findall(r'\[ACCION: (.*?)\]', ai_text)
-        if actions_found:
-            suggested_actions = actions_found
-            # Remove actions from text to keep it clean
-            ai_text = re.sub(r'\[ACCION: .*?\]', '', ai_text).strip()
-
-        status = 'analyzing'
-        if '⚠️' in ai_text or 'riesgo' in ai_text.lower():
-            status = 'risk'
-        elif 'contrato' in ai_text.lower() or 'documento' in ai_text.lower():
-            status = 'document'
-            
-        return {"text": ai_text, "status": status, "suggested_actions": suggested_actions}
+        started = time.perf_counter()
+        result = parse_ai_text(response.choices[0].message.content)
+        timings["parse"] = round(time.perf_counter() - started, 4)
+        if cache_key:
+            save_cached_response(cache_key, result, provider)
+        result["usage"] = record_usage(getattr(response, 'usage', None))
+        result["provider"] = provider
+        result["timings"] = timings
+        result["prompt_tokens"] = token_counts
+        observe_result(result, 'ok', messages_payload)
+        return result
 
     except Exception as e:
-        print(f"OpenAI Error: {e}")
-        if "insufficient_quota" in str(e) or "429" in str(e):
-            return {
-                "text": "⚠️ **Aviso de Sistema**: El servicio de IA está temporalmente saturado (Cuota Excedida). \n\n" + 
-                        "Sin embargo, puedo orientarle con información general: \n" +
-                        "Para temas laborales, consulte el Código Sustantivo del Trabajo. \n" +
-                        "Para temas inmobiliarios, la Ley 820 de 2003. \n" +
-                        "Le sugiero contactar directamente a nuestros abogados humanos.",
-                "status": "risk"
-            }
-            
-        return {
-            "text": "Lo siento, estoy experimentando dificultades técnicas para procesar tu consulta legal en este momento. Por favor, intenta de nuevo más tarde.",
-            "status": "analyzing"
-        }
+        metrics.chat_responses.inc(outcome='error')
+        return error_result(e)
+
+class ActionStreamParser:
+    """Separa los marcadores [ACCION: ...] del texto a medida que llegan los tokens.
+
+    Retiene en el buffer solo lo que podría ser el inicio de un marcador, de modo que el resto
+    del texto se puede reenviar al cliente de inmediato.
+    """
+    MAX_MARKER_LENGTH = 200
+
+    def __init__(self):
+        self.buffer = ""
+        self.actions = []
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        text_parts = []
+        new_actions = []
+        while self.buffer:
+            start = self.buffer.find("[")
+            if start == -1:
+                text_parts.append(self.buffer)
+                self.buffer = ""
+                break
+            text_parts.append(self.buffer[:start])
+            self.buffer = self.buffer[start:]
+
+            if not self.buffer.startswith(ACTION_MARKER):
+                if ACTION_MARKER.startswith(self.buffer):
+                    break # Could still become a marker, wait for more tokens
+                text_parts.append("[")
+                self.buffer = self.buffer[1:]
+                continue
+
+            end = self.buffer.find("]")
+            if end == -1:
+                if len(self.buffer) > self.MAX_MARKER_LENGTH:
+                    text_parts.append(self.buffer)
+                    self.buffer = ""
+                break
+            action = self.buffer[len(ACTION_MARKER):end].strip()
+            if action:
+                new_actions.append(action)
+            self.buffer = self.buffer[end + 1:]
+
+        self.actions.extend(new_actions)
+        return "".join(text_parts), new_actions
+
+    def flush(self):
+        rest, self.buffer = self.buffer, ""
+        return rest
+
+def stream_response(message, conversation_id=None, document_context=None, first_turn=False, message_id=None):
+    """Versión en streaming de generate_response.
+
+    Produce eventos {"type": "token"|"action", ...} y un evento final {"type": "done", "result": {...}}
+    con el mismo formato que devuelve generate_response.
+    """
+    if not has_providers():
+        result = dict(CONFIG_ERROR_RESULT)
+        yield {"type": "token", "text": result["text"]}
+        yield {"type": "done", "result": result}
+        return
+
+    cache_key, cached = lookup_cached_response(message, first_turn, document_context)
+    if cached:
+        cached["cached"] = True
+        observe_result(cached, 'cached')
+        yield {"type": "token", "text": cached["text"]}
+        for action in cached["suggested_actions"]:
+            yield {"type": "action", "action": action}
+        yield {"type": "done", "result": cached}
+        return
+
+    parser = ActionStreamParser()
+    text_parts = []
+    timings = {}
+    token_counts = {}
+    usage = None
+    try:
+        started = time.perf_counter()
+        messages_payload = build_messages_payload(message, conversation_id, document_context, timings=timings,
+                                                  token_counts=token_counts, message_id=message_id)
+        timings["context"] = round(time.perf_counter() - started, 4)
+        release_db_connection()
+
+        started = time.perf_counter()
+        stream, provider = chat_completion(
+            messages=messages_payload,
+            temperature=0.3,
+            stream=True,
+            stream_options={"include_usage": True}, # Final chunk carries the usage block
+        )
+
+        for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if "first_token" not in timings:
+                timings["first_token"] = round(time.perf_counter() - started, 4)
+            text, actions = parser.feed(delta)
+            if text:
+                text_parts.append(text)
+                yield {"type": "token", "text": text}
+            for action in actions:
+                yield {"type": "action", "action": action}
+
+        rest = parser.flush()
+        if rest:
+            text_parts.append(rest)
+            yield {"type": "token", "text": rest}
+        timings["llm"] = round(time.perf_counter() - started, 4)
+
+    except Exception as e:
+        metrics.chat_responses.inc(outcome='error')
+        result = error_result(e)
+        if text_parts:
+            # Keep what was already shown to the user instead of replacing it
+            ai_text = "".join(text_parts).strip()
+            result = {"text": ai_text, "status": classify_status(ai_text), "suggested_actions": parser.actions}
+        else:
+            yield {"type": "token", "text": result["text"]}
+        yield {"type": "done", "result": result}
+        return
+
+    ai_text = "".join(text_parts).strip()
+    result = {"text": ai_text, "status": classify_status(ai_text), "suggested_actions": parser.actions}
+    if cache_key:
+        save_cached_response(cache_key, result, provider)
+    result["usage"] = record_usage(usage)
+    result["provider"] = provider
+    result["timings"] = timings
+    result["prompt_tokens"] = token_counts
+    observe_result(result, 'ok', messages_payload)
+    yield {"type": "done", "result": result}
@@ -0,0 +1,73 @@
+import re
+from sqlalchemy import update, func, bindparam
+from extensions import db
+from models import Conversation, Message
+
+# Conversation.last_message_at / message_count / last_message_preview are denormalized from messages:
+# every insert updates them in the same transaction, and backfill() recomputes them from the table.
+PREVIEW_LENGTH = 200
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def message_preview(content):
+    text = WHITESPACE_RE.sub(' ', content or '').strip()
+    return text[:PREVIEW_LENGTH - 3] + "..." if len(text) > PREVIEW_LENGTH else text
+
+
+def record_message(message):
+    """Updates the activity columns of the message's conversation. The caller commits with the message.
+
+    A single UPDATE with message_count + 1, so concurrent turns in the same conversation never lose a count.
+    """
+    db.session.execute(
+        update(Conversation)
+        .where(Conversation.id == message.conversation_id)
+        .values(
+            message_count=Conversation.message_count + 1,
+            last_message_at=message.created_at,
+            last_message_preview=message_preview(message.content),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def backfill(batch_size=1000, progress=None):
+    """Recomputes the activity columns of every conversation from messages, in batches of conversation ids.
+
+    Conversations without messages get message_count 0 and last_message_at = created_at. Returns the number
+    of conversations updated.
+    """
+    stmt = (
+        update(Conversation.__table__)
+        .where(Conversation.__table__.c.id == bindparam('conversation_id'))
+        .values(message_count=bindparam('count'), last_message_at=bindparam('last_at'), last_message_preview=bindparam('preview'))
+    )
+    updated, last_id = 0, 0
+    while True:
+        batch = db.session.query(Conversation.id, Conversation.created_at).filter(
+            Conversation.id > last_id).order_by(Conversation.id).limit(batch_size).all()
+        if not batch:
+            return updated
+        ids = [row.id for row in batch]
+        totals = {row.conversation_id: row for row in db.session.query(
+            Message.conversation_id, func.count(Message.id).label('count'), func.max(Message.id).label('last_id')
+        ).filter(Message.conversation_id.in_(ids)).group_by(Message.conversation_id)}
+        last_messages = {row.id: row for row in db.session.query(Message.id, Message.content, Message.created_at).filter(
+            Message.id.in_([row.last_id for row in totals.values()]))} if totals else {}
+
+        params = []
+        for conversation_id, created_at in batch:
+            total = totals.get(conversation_id)
+            last = last_messages.get(total.last_id) if total else None
+            params.append({
+                "conversation_id": conversation_id,
+                "count": total.count if total else 0,
+                "last_at": last.created_at if last else created_at,
+                "preview": message_preview(last.content) if last else None,
+            })
+        db.session.execute(stmt, params)
+        db.session.commit()
+        updated += len(params)
+        last_id = ids[-1]
+        if progress:
+            progress(updated)
@@ -0,0 +1,95 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import UploadedDocument
+from services.extraction import ExtractionError, extract_text, run_in_process
+from services.retrieval import PassageIndex
+
+DOCUMENT_PREVIEW_CHARS = int(os.getenv('DOCUMENT_PREVIEW_CHARS', '500'))
+# Number of conversations whose document text is kept in memory per worker
+DOCUMENT_CACHE_SIZE = int(os.getenv('DOCUMENT_CACHE_SIZE', '128'))
+
+_document_cache = OrderedDict()
+_document_cache_lock = threading.Lock()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def store_uploaded_document(path, filename, ext):
+    """Guarda el documento una sola vez por contenido. Devuelve (documento, deduplicado, extracción)."""
+    content_hash = file_sha256(path)
+    existing = UploadedDocument.query.filter_by(content_hash=content_hash).first()
+    if existing:
+        return existing, True, None
+
+    result = extract_text(path, ext)
+    if not result.text.strip():
+        raise ExtractionError("No se pudo extraer texto del archivo. El archivo puede estar vacío o protegido.")
+
+    document = UploadedDocument(
+        content_hash=content_hash,
+        filename=filename,
+        file_type=ext.lstrip('.'),
+        content=result.text,
+        preview=result.text[:DOCUMENT_PREVIEW_CHARS],
+        characters=len(result.text),
+        pages=result.pages
+    )
+    try:
+        db.session.add(document)
+        db.session.commit()
+    except IntegrityError:
+        # Same file uploaded concurrently by another request
+        db.session.rollback()
+        return UploadedDocument.query.filter_by(content_hash=content_hash).first(), True, result
+    return document, False, result
+
+
+def document_to_dict(document):
+    return {
+        "documentId": document.id,
+        "filename": document.filename,
+        "characters": document.characters,
+        "pages": document.pages,
+        # Documents stored before the preview column existed fall back to loading the text
+        "preview": document.preview if document.preview is not None else document.content[:DOCUMENT_PREVIEW_CHARS]
+    }
+
+
+def load_document(conversation_id, document_id):
+    """Texto del documento de la conversación, cargado de la BD solo la primera vez."""
+    with _document_cache_lock:
+        cached = _document_cache.get(conversation_id)
+        if cached and cached["document_id"] == document_id:
+            _document_cache.move_to_end(conversation_id)
+            return cached
+
+    row = db.session.query(UploadedDocument.filename, UploadedDocument.content).filter_by(id=document_id).first()
+    if not row:
+        return None
+
+    entry = {"document_id": document_id, "filename": row.filename, "text": row.content}
+    with _document_cache_lock:
+        _document_cache[conversation_id] = entry
+        _document_cache.move_to_end(conversation_id)
+        while len(_document_cache) > DOCUMENT_CACHE_SIZE:
+            _document_cache.popitem(last=False)
+    return entry
+
+
+def get_document_index(entry):
+    """Índice de pasajes del documento, construido una vez (en el pool de procesos) y guardado junto al texto en caché."""
+    index = entry.get("index")
+    if index is None:
+        index = run_in_process(PassageIndex, entry["text"])
+        entry["index"] = index
+    return index
@@ -0,0 +1,257 @@
+import os
+import time
+import codecs
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+SUPPORTED_EXTENSIONS = {'.pdf', '.docx', '.txt'}
+
+# All parsing runs in the process pool: the web workers are gevent, so CPU work in the worker process itself
+# would stall every request in flight
+EXTRACT_MAX_PAGES = int(os.getenv('EXTRACT_MAX_PAGES', '2000'))
+EXTRACT_TIMEOUT_SECONDS = float(os.getenv('EXTRACT_TIMEOUT_SECONDS', '90'))
+# PDFs are split in batches of this many pages across the process pool
+EXTRACT_BATCH_PAGES = int(os.getenv('EXTRACT_BATCH_PAGES', '20'))
+EXTRACT_PROCESSES = int(os.getenv('EXTRACT_PROCESSES', str(os.cpu_count() or 2)))
+# Pool processes are replaced after this many tasks (memory held by the parsers)
+EXTRACT_MAX_TASKS_PER_CHILD = int(os.getenv('EXTRACT_MAX_TASKS_PER_CHILD', '100'))
+TXT_READ_BYTES = 64 * 1024
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+class ExtractionError(Exception):
+    pass
+
+
+class ExtractionResult:
+    def __init__(self, text, pages, page_timings, seconds):
+        self.text = text
+        self.pages = pages
+        self.page_timings = page_timings # Seconds spent on each page (or block for DOCX/TXT)
+        self.seconds = seconds
+
+    def to_dict(self):
+        return {
+            "pages": self.pages,
+            "characters": len(self.text),
+            "seconds": round(self.seconds, 4),
+            "slowestPageSeconds": round(max(self.page_timings), 4) if self.page_timings else 0
+        }
+
+
+def get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # 'spawn' avoids forking a multi-threaded gunicorn worker
+            _process_pool = ProcessPoolExecutor(max_workers=EXTRACT_PROCESSES, mp_context=multiprocessing.get_context('spawn'),
+                                                max_tasks_per_child=EXTRACT_MAX_TASKS_PER_CHILD)
+        return _process_pool
+
+
+def retire_process_pool(pool):
+    """Kills the processes of `pool` after a task overran its deadline (cancel() cannot stop a running task);
+    later calls get a new pool. Tasks of other callers running on it fail with BrokenProcessPool and are
+    submitted again by submit_task's callers."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    # ProcessPoolExecutor has no public API to stop its processes
+    processes = list((getattr(pool, '_processes', None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+    print(f"Extraction pool retired after a timeout ({len(processes)} processes terminated)")
+
+
+def submit_task(fn, *args):
+    """(future, pool) of fn(*args) in the current process pool, even if it was just retired."""
+    try:
+        pool = get_process_pool()
+        return pool.submit(fn, *args), pool
+    except (BrokenProcessPool, RuntimeError):
+        pool = get_process_pool()
+        return pool.submit(fn, *args), pool
+
+
+def run_in_process(fn, *args, deadline=None):
+    """fn(*args) in the process pool, waiting until the time.monotonic() `deadline` at most.
+
+    `fn` and its arguments must be picklable (module-level functions). Raises ExtractionError on timeout,
+    after killing the process that was running it.
+    """
+    for attempt in range(2):
+        future, pool = submit_task(fn, *args)
+        try:
+            return future.result(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+        except TimeoutError:
+            retire_process_pool(pool)
+            raise ExtractionError("Tiempo de extracción excedido")
+        except BrokenProcessPool:
+            # Another caller's timeout retired the pool under this task: run it again, once
+            if attempt:
+                raise
+
+
+def file_extension(filename):
+    filename = (filename or '').lower()
+    return '.' + filename.rsplit('.', 1)[-1] if '.' in filename else ''
+
+
+def count_pdf_pages(path):
+    """Runs in a worker process."""
+    from PyPDF2 import PdfReader
+    return len(PdfReader(path).pages)
+
+
+def count_pages(path, ext, deadline=None):
+    if ext == '.pdf':
+        return run_in_process(count_pdf_pages, path, deadline=deadline)
+    return 1
+
+
+def extract_pdf_pages(path, start, end):
+    """Runs in a worker process: [(text, seconds)] for pages [start, end)."""
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    pages = []
+    for i in range(start, end):
+        started = time.perf_counter()
+        text = reader.pages[i].extract_text() or ''
+        pages.append((text, time.perf_counter() - started))
+    return pages
+
+
+def _iter_pdf(path, pages_total, deadline):
+    starts = iter(range(0, pages_total, EXTRACT_BATCH_PAGES))
+    pending = {} # future -> (first page, pool)
+    ready = {}
+    retried = set()
+    next_start = 0
+
+    def submit(start):
+        future, pool = submit_task(extract_pdf_pages, path, start, min(start + EXTRACT_BATCH_PAGES, pages_total))
+        pending[future] = (start, pool)
+
+    # Only as many batches in flight as there are processes, so one large PDF does not queue ahead of every
+    # other upload and nothing new is submitted once the deadline has passed
+    for start in starts:
+        submit(start)
+        if len(pending) >= EXTRACT_PROCESSES:
+            break
+    try:
+        while pending or ready:
+            # Yield batches in page order as soon as the next one is available
+            while next_start in ready:
+                batch = ready.pop(next_start)
+                next_start += len(batch)
+                yield from batch
+            if not pending:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Stop the batches still being parsed instead of leaving them to hold the pool
+                for pool in {pool for _, pool in pending.values()}:
+                    retire_process_pool(pool)
+                raise ExtractionError("Tiempo de extracción excedido")
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, _ = pending.pop(future)
+                try:
+                    ready[start] = future.result()
+                except BrokenProcessPool:
+                    # Pool retired by another caller's timeout: parse the batch again, once
+                    if start in retried:
+                        raise
+                    retried.add(start)
+                    submit(start)
+                    continue
+                if time.monotonic() < deadline:
+                    start = next(starts, None)
+                    if start is not None:
+                        submit(start)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def extract_docx_blocks(path):
+    """Runs in a worker process: [(text, seconds)] per paragraph and table row."""
+    from docx import Document
+    blocks = []
+    started = time.perf_counter()
+    doc = Document(path)
+    for para in doc.paragraphs:
+        if para.text.strip():
+            blocks.append((para.text + '\n', time.perf_counter() - started))
+            started = time.perf_counter()
+    # Also extract text from tables
+    for table in doc.tables:
+        for row in table.rows:
+            row_text = ' | '.join(cell.text.strip() for cell in row.cells)
+            blocks.append((row_text + '\n', time.perf_counter() - started))
+            started = time.perf_counter()
+    return blocks
+
+
+def extract_txt_blocks(path):
+    """Runs in a worker process: [(text, seconds)] per block read."""
+    # Try UTF-8 first, then latin-1
+    for encoding in ('utf-8', 'latin-1'):
+        decoder = codecs.getincrementaldecoder(encoding)()
+        parts = []
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    started = time.perf_counter()
+                    block = f.read(TXT_READ_BYTES)
+                    parts.append((decoder.decode(block, final=not block), time.perf_counter() - started))
+                    if not block:
+                        break
+        except UnicodeDecodeError:
+            continue
+        return parts
+    return []
+
+
+def iter_text(path, ext, max_pages=None, timeout=None, on_pages_total=None):
+    """Genera (texto, segundos) por página (PDF) o por bloque (DOCX/TXT) a medida que se extrae.
+
+    `on_pages_total(pages)` recibe el número de páginas en cuanto se conoce (1 para DOCX/TXT).
+    """
+    max_pages = max_pages or EXTRACT_MAX_PAGES
+    deadline = time.monotonic() + (timeout or EXTRACT_TIMEOUT_SECONDS)
+
+    pages_total = count_pages(path, ext, deadline=deadline) if ext in SUPPORTED_EXTENSIONS else None
+    if on_pages_total and pages_total is not None:
+        on_pages_total(pages_total)
+    if ext == '.pdf':
+        if pages_total > max_pages:
+            raise ExtractionError(f"El documento tiene {pages_total} páginas (máximo {max_pages})")
+        yield from _iter_pdf(path, pages_total, deadline)
+    elif ext == '.docx':
+        yield from run_in_process(extract_docx_blocks, path, deadline=deadline)
+    elif ext == '.txt':
+        yield from run_in_process(extract_txt_blocks, path, deadline=deadline)
+    else:
+        raise ExtractionError(f"Tipo de archivo no soportado: {ext}")
+
+
+def extract_text(path, ext, on_page=None, max_pages=None, timeout=None, on_pages_total=None):
+    """Extrae todo el texto. `on_page(pages_done)` se llama tras cada página/bloque."""
+    started = time.perf_counter()
+    parts = []
+    page_timings = []
+    for text, seconds in iter_text(path, ext, max_pages=max_pages, timeout=timeout, on_pages_total=on_pages_total):
+        parts.append(text)
+        page_timings.append(seconds)
+        if on_page:
+            on_page(len(page_timings))
+    if ext == '.pdf':
+        return ExtractionResult('\n'.join(parts), len(page_timings), page_timings, time.perf_counter() - started)
+    return ExtractionResult(''.join(parts), 1, page_timings, time.perf_counter() - started)
@@ -0,0 +1,141 @@
+import os
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# Jobs are driven by a small thread pool; parsing and BM25 tokenization run in services.extraction's process pool
+INGEST_RUNNERS = int(os.getenv('INGEST_RUNNERS', '1'))
+# Progress is committed every N pages
+INGEST_PROGRESS_PAGES = int(os.getenv('INGEST_PROGRESS_PAGES', '20'))
+
+_runner = ThreadPoolExecutor(max_workers=INGEST_RUNNERS, thread_name_prefix='kb-ingest')
+
+
+def submit_job(app, job_id):
+    _runner.submit(run_job, app, job_id)
+
+
+def remove_upload(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def recover_interrupted_jobs():
+    """Run once per server start, before any worker: jobs left 'running' by the previous server are marked
+    failed (a file that crashes the worker must not be retried forever) and their uploads removed.
+    Jobs still 'queued' are picked up again by resume_queued_jobs. Returns the number of jobs failed."""
+    from extensions import db
+    from models import IngestionJob
+
+    jobs = IngestionJob.query.filter_by(status='running').all()
+    for job in jobs:
+        job.status = 'failed'
+        job.error = "Interrupted by a server restart, upload the file again"
+        job.finished_at = datetime.utcnow()
+        remove_upload(job.file_path)
+    db.session.commit()
+    return len(jobs)
+
+
+def resume_queued_jobs(app):
+    """Submits the jobs still queued (e.g. accepted by a worker that was restarted). A job submitted twice
+    runs once: run_job claims it first."""
+    from extensions import db
+    from models import IngestionJob
+
+    with app.app_context():
+        job_ids = [row.id for row in db.session.query(IngestionJob.id).filter_by(status='queued').order_by(IngestionJob.id)]
+    for job_id in job_ids:
+        submit_job(app, job_id)
+    return len(job_ids)
+
+
+def run_job(app, job_id):
+    from sqlalchemy import update
+    from extensions import db
+    from models import IngestionJob, KnowledgeBase
+    from services.knowledge_index import index_document, bump_kb_version, kb_content_fields
+
+    with app.app_context():
+        # Conditional UPDATE: a job submitted by more than one worker is only run by the first
+        claimed = db.session.execute(
+            update(IngestionJob)
+            .where(IngestionJob.id == job_id, IngestionJob.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            return
+        job = db.session.get(IngestionJob, job_id)
+        file_path = job.file_path
+
+        try:
+            from services.extraction import extract_text, file_extension
+            ext = file_extension(job.filename)
+
+            def on_pages_total(pages_total):
+                # Counted by the extraction itself, within its deadline
+                job.pages_total = pages_total
+                db.session.commit()
+
+            def on_page(pages_done):
+                if pages_done % INGEST_PROGRESS_PAGES == 0 or pages_done == job.pages_total:
+                    job.pages_done = pages_done
+                    db.session.commit()
+
+            result = extract_text(job.file_path, ext, on_page=on_page if ext == '.pdf' else None,
+                                  on_pages_total=on_pages_total)
+            from services import metrics
+            metrics.extraction_duration.observe(result.seconds, source='knowledge', file_type=ext.lstrip('.'))
+            metrics.extraction_pages.observe(result.pages, source='knowledge', file_type=ext.lstrip('.'))
+            text_content = result.text
+            if not text_content.strip():
+                raise ValueError("No text could be extracted from the file")
+
+            kb_item = KnowledgeBase(title=job.filename, content=text_content, file_type=ext.lstrip('.'),
+                                    **kb_content_fields(text_content))
+            db.session.add(kb_item)
+            db.session.flush()
+            index_document(kb_item)
+            bump_kb_version()
+
+            job.pages_done = job.pages_total
+            job.kb_id = kb_item.id
+            job.characters = len(text_content)
+            job.status = 'done'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+        except Exception as e:
+            print(f"Error processing ingestion job {job_id}: {e}")
+            db.session.rollback()
+            job = db.session.get(IngestionJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+        finally:
+            # The upload is only needed while the job runs, whatever its outcome
+            remove_upload(file_path)
+
+
+def job_to_dict(job):
+    duration = None
+    if job.started_at:
+        duration = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+    return {
+        "id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "pagesTotal": job.pages_total,
+        "pagesDone": job.pages_done or 0,
+        "progress": round((job.pages_done or 0) / job.pages_total, 3) if job.pages_total else 0,
+        "characters": job.characters,
+        "knowledgeId": job.kb_id,
+        "error": job.error,
+        "createdAt": job.created_at.isoformat(),
+        "startedAt": job.started_at.isoformat() if job.started_at else None,
+        "finishedAt": job.finished_at.isoformat() if job.finished_at else None,
+        "queuedSeconds": (job.started_at - job.created_at).total_seconds() if job.started_at else None,
+        "durationSeconds": duration
+    }
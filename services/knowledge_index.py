@@ -0,0 +1,141 @@
+import os
+import hashlib
+from collections import Counter
+from datetime import datetime
+from flask import g, has_app_context
+from sqlalchemy import func, insert, delete, update
+from extensions import db
+from models import KnowledgeBase, KnowledgeChunk, KnowledgeTerm, KnowledgeBaseVersion
+from services.retrieval import tokenize, passage_terms, bm25_score, estimate_tokens
+
+KB_TOP_K = int(os.getenv('KB_TOP_K', '6'))
+KB_TOKEN_BUDGET = int(os.getenv('KB_TOKEN_BUDGET', '3000'))
+KB_PASSAGE_CHARS = int(os.getenv('KB_PASSAGE_CHARS', '1500'))
+KB_VERSION_ROW = 1
+KB_PREVIEW_CHARS = 200
+
+
+def kb_content_fields(content):
+    """preview, char_count and content_hash of an extracted text, stored with the document at ingest."""
+    return {
+        "preview": " ".join(content[:KB_PREVIEW_CHARS * 2].split())[:KB_PREVIEW_CHARS],
+        "char_count": len(content),
+        "content_hash": hashlib.sha256(content.encode('utf-8')).hexdigest(),
+    }
+
+
+def get_kb_version():
+    """Versión actual de la base de conocimiento, leída como mucho una vez por contexto de app.
+
+    Las etapas de `gather_context` corren en su propio contexto de app (con `g` vacío), así que
+    reciben la versión ya leída como argumento en lugar de llamar a esta función.
+    """
+    if has_app_context() and 'kb_version' in g:
+        return g.kb_version
+    version = db.session.query(KnowledgeBaseVersion.version).filter_by(id=KB_VERSION_ROW).scalar() or 0
+    if has_app_context():
+        g.kb_version = version
+    return version
+
+
+def bump_kb_version():
+    """Invalida las cachés de KB de todos los workers. El llamador hace commit."""
+    result = db.session.execute(
+        update(KnowledgeBaseVersion)
+        .where(KnowledgeBaseVersion.id == KB_VERSION_ROW)
+        .values(version=KnowledgeBaseVersion.version + 1, updated_at=datetime.utcnow())
+    )
+    if result.rowcount == 0:
+        db.session.add(KnowledgeBaseVersion(id=KB_VERSION_ROW, version=1))
+    g.pop('kb_version', None)
+
+
+def corpus_stats():
+    n_docs, avg_len = db.session.query(func.count(KnowledgeChunk.id), func.avg(KnowledgeChunk.length)).one()
+    return n_docs, float(avg_len or 0)
+
+
+def delete_document_index(kb_id):
+    chunk_ids = db.session.query(KnowledgeChunk.id).filter(KnowledgeChunk.kb_id == kb_id)
+    db.session.execute(delete(KnowledgeTerm).where(KnowledgeTerm.chunk_id.in_(chunk_ids.scalar_subquery())))
+    db.session.execute(delete(KnowledgeChunk).where(KnowledgeChunk.kb_id == kb_id))
+
+
+def index_document(kb_item):
+    """Divide el documento en pasajes y guarda su índice invertido. El llamador hace commit.
+
+    La tokenización corre en el pool de procesos de services.extraction, fuera del worker web.
+    """
+    from services.extraction import run_in_process
+    delete_document_index(kb_item.id)
+
+    chunks = []
+    chunk_terms = []
+    for position, passage, terms in run_in_process(passage_terms, kb_item.content, KB_PASSAGE_CHARS):
+        chunks.append(KnowledgeChunk(kb_id=kb_item.id, position=position, content=passage, length=sum(terms.values())))
+        chunk_terms.append(terms)
+
+    db.session.add_all(chunks)
+    db.session.flush()
+
+    postings = [
+        {"term": term, "chunk_id": chunk.id, "tf": tf}
+        for chunk, terms in zip(chunks, chunk_terms)
+        for term, tf in terms.items()
+    ]
+    if postings:
+        db.session.execute(insert(KnowledgeTerm), postings)
+    return len(chunks)
+
+
+def search_knowledge(query, top_k=None, token_budget=None, stats=None):
+    """Devuelve los pasajes de la base de conocimiento más relevantes (BM25) dentro del presupuesto de tokens.
+
+    `stats` permite reutilizar (n_docs, avg_len) ya calculados para la versión vigente de la KB.
+    """
+    top_k = top_k or KB_TOP_K
+    token_budget = token_budget or KB_TOKEN_BUDGET
+
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+
+    n_docs, avg_len = stats or corpus_stats()
+    if not n_docs:
+        return []
+
+    postings = db.session.query(
+        KnowledgeTerm.term, KnowledgeTerm.chunk_id, KnowledgeTerm.tf, KnowledgeChunk.length
+    ).join(KnowledgeChunk, KnowledgeChunk.id == KnowledgeTerm.chunk_id).filter(KnowledgeTerm.term.in_(terms)).all()
+
+    df = Counter(p.term for p in postings)
+    scores = Counter()
+    for p in postings:
+        scores[p.chunk_id] += bm25_score(p.tf, df[p.term], n_docs, p.length, avg_len)
+
+    best = [chunk_id for chunk_id, _ in scores.most_common(top_k)]
+    if not best:
+        return []
+
+    rows = db.session.query(
+        KnowledgeChunk.id, KnowledgeChunk.position, KnowledgeChunk.content, KnowledgeBase.title
+    ).join(KnowledgeBase, KnowledgeBase.id == KnowledgeChunk.kb_id).filter(KnowledgeChunk.id.in_(best)).all()
+    by_id = {r.id: r for r in rows}
+
+    passages = []
+    used_tokens = 0
+    for chunk_id in best:
+        row = by_id.get(chunk_id)
+        if not row:
+            continue
+        tokens = estimate_tokens(row.content)
+        if passages and used_tokens + tokens > token_budget:
+            break
+        used_tokens += tokens
+        passages.append({
+            "title": row.title,
+            "position": row.position,
+            "content": row.content,
+            "score": scores[chunk_id]
+        })
+    return passages
@@ -0,0 +1,242 @@
+import os
+import time
+import random
+import threading
+import openai
+from dotenv import load_dotenv
+from services import metrics
+
+load_dotenv()
+
+try:
+    from httpx import Limits
+except ImportError: # Newer openai releases ship httpx2
+    from httpx2 import Limits
+
+# Providers are tried in this order; the ones without an API key are skipped
+LLM_PROVIDERS = [p.strip() for p in os.getenv('LLM_PROVIDERS', 'deepseek,openai').split(',') if p.strip()]
+
+PROVIDER_DEFAULTS = {
+    "deepseek": {"key_env": "DEEPSEEK_API_KEY", "base_url": "https://api.deepseek.com", "model": "deepseek-chat"},
+    "openai": {"key_env": "OPENAI_API_KEY", "base_url": None, "model": "gpt-3.5-turbo"},
+}
+
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '60'))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '200'))
+LLM_MAX_KEEPALIVE = int(os.getenv('LLM_MAX_KEEPALIVE', '50'))
+
+# Attempts per provider before failing over, with full-jitter exponential backoff between them
+LLM_MAX_ATTEMPTS = int(os.getenv('LLM_MAX_ATTEMPTS', '2'))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.5'))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '4'))
+
+# Consecutive failures that open a provider's circuit, and how long it stays open before a probe
+LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', '5'))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', '30'))
+
+
+class LLMUnavailableError(Exception):
+    """No provider could answer. `last_error` is the error from the last provider tried."""
+
+    def __init__(self, message, last_error=None):
+        super().__init__(message)
+        self.last_error = last_error
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half_open (one probe) after the reset time.
+
+    A probe that never reports back (lost to an unexpected exception) does not wedge the breaker: after
+    another reset period in half_open a new probe is let through.
+    """
+
+    def __init__(self, threshold, reset_seconds):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if self.state in ('open', 'half_open') and now - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open' # Let this request through as the probe
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self, trip=False):
+        with self.lock:
+            self.failures += 1
+            if trip or self.state == 'half_open' or self.failures >= self.threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class Provider:
+    def __init__(self, name, api_key, base_url, model):
+        self.name = name
+        self.model = model
+        self.breaker = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_RESET_SECONDS)
+        # Retries are done here, not by the SDK, so they can fail over and feed the breaker
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            timeout=openai.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            http_client=openai.DefaultHttpxClient(
+                limits=Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE)
+            ),
+        )
+        self.stats = {"requests": 0, "success": 0, "errors": 0, "retries": 0, "failovers": 0,
+                      "rejected": 0, "latency_seconds": 0.0}
+
+
+def build_providers():
+    providers = []
+    for name in LLM_PROVIDERS:
+        defaults = PROVIDER_DEFAULTS.get(name)
+        if not defaults:
+            print(f"WARNING: Unknown LLM provider '{name}', ignoring it")
+            continue
+        api_key = os.getenv(defaults["key_env"])
+        if not api_key or "placeholder" in api_key:
+            continue
+        prefix = name.upper()
+        base_url = os.getenv(f"{prefix}_BASE_URL", defaults["base_url"])
+        model = os.getenv(f"{prefix}_MODEL", defaults["model"])
+        providers.append(Provider(name, api_key, base_url, model))
+    return providers
+
+
+PROVIDERS = build_providers()
+_stats_lock = threading.Lock()
+
+
+def has_providers():
+    return bool(PROVIDERS)
+
+
+def primary_model():
+    return PROVIDERS[0].model if PROVIDERS else None
+
+
+def primary_provider():
+    return PROVIDERS[0].name if PROVIDERS else None
+
+
+def _count(provider, key, value=1):
+    with _stats_lock:
+        provider.stats[key] += value
+
+
+def is_quota_error(e):
+    return isinstance(e, openai.APIStatusError) and 'insufficient_quota' in str(e)
+
+
+def is_retryable(e):
+    if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and (e.status_code == 429 or e.status_code >= 500)
+
+
+def is_provider_failure(e):
+    """Errors that say something about the provider (not the request) and count against its circuit."""
+    if is_retryable(e) or is_quota_error(e):
+        return True
+    return isinstance(e, (openai.AuthenticationError, openai.PermissionDeniedError))
+
+
+def backoff_seconds(attempt, error=None):
+    # Honour a short Retry-After from the provider, otherwise full jitter
+    retry_after = None
+    if isinstance(error, openai.APIStatusError):
+        try:
+            retry_after = float(error.response.headers.get('retry-after'))
+        except (TypeError, ValueError):
+            retry_after = None
+    if retry_after is not None and retry_after <= LLM_BACKOFF_MAX:
+        return retry_after
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
+def chat_completion(messages, **params):
+    """Llama al primer proveedor disponible. Devuelve (respuesta, nombre del proveedor).
+
+    Reintenta con backoff los errores transitorios, salta a otro proveedor cuando uno falla o agota
+    su cuota y no llama a los que tienen el circuito abierto. Con stream=True el failover solo cubre
+    el inicio de la respuesta.
+    """
+    if not PROVIDERS:
+        raise LLMUnavailableError("No LLM provider configured")
+
+    last_error = None
+    for position, provider in enumerate(PROVIDERS):
+        if position:
+            _count(provider, "failovers")
+        if not provider.breaker.allow():
+            _count(provider, "rejected")
+            continue
+
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            if attempt:
+                _count(provider, "retries")
+                time.sleep(backoff_seconds(attempt - 1, last_error))
+            _count(provider, "requests")
+            started = time.perf_counter()
+            try:
+                response = provider.client.chat.completions.create(model=provider.model, messages=messages, **params)
+            except openai.APIError as e:
+                last_error = e
+                _count(provider, "errors")
+                metrics.llm_requests.inc(provider=provider.name, outcome='error')
+                metrics.llm_duration.observe(time.perf_counter() - started, provider=provider.name, outcome='error')
+                print(f"LLM provider '{provider.name}' failed (attempt {attempt + 1}): {e}")
+                if not is_provider_failure(e):
+                    # The request itself is wrong, another provider won't help. The provider did answer,
+                    # so it counts as healthy (this also closes the circuit if the call was the half-open probe)
+                    provider.breaker.record_success()
+                    raise
+                provider.breaker.record_failure(trip=is_quota_error(e))
+                if is_quota_error(e) or not is_retryable(e) or not provider.breaker.allow():
+                    break
+                continue
+
+            elapsed = time.perf_counter() - started
+            _count(provider, "success")
+            _count(provider, "latency_seconds", elapsed)
+            metrics.llm_requests.inc(provider=provider.name, outcome='success')
+            metrics.llm_duration.observe(elapsed, provider=provider.name, outcome='success')
+            provider.breaker.record_success()
+            return response, provider.name
+
+    raise LLMUnavailableError("All LLM providers failed or are unavailable", last_error)
+
+
+CIRCUIT_STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+def collect_metrics():
+    for provider in PROVIDERS:
+        metrics.llm_circuit_state.set(CIRCUIT_STATE_VALUES[provider.breaker.state], provider=provider.name)
+
+
+metrics.registry.add_collector(collect_metrics)
+
+
+def get_gateway_stats():
+    with _stats_lock:
+        return {
+            p.name: dict(p.stats, model=p.model, circuit=p.breaker.state, consecutive_failures=p.breaker.failures)
+            for p in PROVIDERS
+        }
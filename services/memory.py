@@ -0,0 +1,126 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func, update, and_, or_
+from extensions import db
+from models import Conversation, Message
+from services.retrieval import estimate_tokens
+
+# History sent to the model is bounded by tokens; older turns are folded into Conversation.summary
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '2000'))
+HISTORY_MAX_MESSAGES = int(os.getenv('HISTORY_MAX_MESSAGES', '40'))
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '400'))
+# Messages folded per summary update; a longer backlog is folded over the following turns, oldest first
+SUMMARY_FOLD_MAX_MESSAGES = int(os.getenv('SUMMARY_FOLD_MAX_MESSAGES', '40'))
+
+SUMMARY_PROMPT = """Mantienes la memoria de una conversación entre un usuario y un asistente legal colombiano.
+Recibes el resumen actual (puede estar vacío) y los mensajes nuevos que salen de la ventana de contexto.
+Devuelve un resumen actualizado, breve y en español, que conserve: hechos del caso, nombres, fechas, valores,
+documentos solicitados o entregados, normas citadas y preguntas pendientes. No agregues información nueva."""
+
+_summary_pool = ThreadPoolExecutor(max_workers=int(os.getenv('SUMMARY_WORKERS', '2')), thread_name_prefix='chat-summary')
+# Conversations with a summary update in flight in this worker
+_pending_summaries = set()
+_pending_lock = threading.Lock()
+
+
+def load_history(conversation_id, before_message_id=None):
+    """Resumen acumulado + los mensajes más recientes que caben en HISTORY_TOKEN_BUDGET.
+
+    `before_message_id` excluye el turno actual (ya guardado) y lo posterior. Si quedan mensajes fuera del presupuesto que aún no están en el resumen, se programa
+    su incorporación en segundo plano para el siguiente turno.
+    """
+    conv = db.session.query(Conversation.summary, Conversation.summary_message_id).filter_by(id=conversation_id).first()
+    if not conv:
+        return {"summary": None, "messages": []}
+    summary_message_id = conv.summary_message_id or 0
+
+    query = db.session.query(Message.id, Message.sender_role, Message.content, Message.created_at).filter(
+        Message.conversation_id == conversation_id, Message.id > summary_message_id
+    )
+    if before_message_id:
+        query = query.filter(Message.id < before_message_id)
+    # (created_at, id) order is served by the ix_messages_conversation_created index without a sort
+    rows = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(HISTORY_MAX_MESSAGES).all()
+
+    kept = []
+    used_tokens = 0
+    for row in rows:
+        tokens = estimate_tokens(row.content)
+        if used_tokens + tokens > HISTORY_TOKEN_BUDGET:
+            break
+        used_tokens += tokens
+        kept.append(row)
+
+    if len(kept) < len(rows) or len(rows) == HISTORY_MAX_MESSAGES:
+        # Everything older than the kept window that is not in the summary yet is folded, including the
+        # turns beyond the HISTORY_MAX_MESSAGES slice; otherwise they would be skipped once the summary moves past them
+        if kept:
+            oldest = kept[-1]
+            older = or_(Message.created_at < oldest.created_at,
+                        and_(Message.created_at == oldest.created_at, Message.id < oldest.id))
+        else:
+            newest = rows[0]
+            older = or_(Message.created_at < newest.created_at,
+                        and_(Message.created_at == newest.created_at, Message.id <= newest.id))
+        pending = query.filter(older).order_by(Message.created_at.asc(), Message.id.asc()).limit(SUMMARY_FOLD_MAX_MESSAGES).all()
+        if pending:
+            schedule_summary_update(conversation_id, conv.summary, summary_message_id, pending)
+    kept.reverse()
+
+    return {
+        "summary": conv.summary,
+        "messages": [
+            {"role": "assistant" if m.sender_role == "assistant" else "user", "content": m.content}
+            for m in kept
+        ]
+    }
+
+
+def schedule_summary_update(conversation_id, summary, summary_message_id, messages):
+    from flask import current_app
+    with _pending_lock:
+        if conversation_id in _pending_summaries:
+            return
+        _pending_summaries.add(conversation_id)
+    app = current_app._get_current_object()
+    payload = [(m.id, m.sender_role, m.content) for m in messages]
+    _summary_pool.submit(update_summary, app, conversation_id, summary, summary_message_id, payload)
+
+
+def update_summary(app, conversation_id, summary, summary_message_id, messages):
+    try:
+        fold_messages(app, conversation_id, summary, summary_message_id, messages)
+    finally:
+        with _pending_lock:
+            _pending_summaries.discard(conversation_id)
+
+
+def fold_messages(app, conversation_id, summary, summary_message_id, messages):
+    from services.llm_gateway import chat_completion
+
+    transcript = "\n\n".join(
+        f"{'Asistente' if role == 'assistant' else 'Usuario'}: {content}" for _, role, content in messages
+    )
+    try:
+        response, _ = chat_completion(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"RESUMEN ACTUAL:\n{summary or '(vacío)'}\n\nMENSAJES NUEVOS:\n{transcript}"}
+            ],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS,
+        )
+        new_summary = response.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"Error updating conversation summary: {e}")
+        return
+
+    with app.app_context():
+        # Only apply if no other turn folded messages in the meantime
+        db.session.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id, func.coalesce(Conversation.summary_message_id, 0) == summary_message_id)
+            .values(summary=new_summary, summary_message_id=messages[-1][0], updated_at=Conversation.updated_at)
+        )
+        db.session.commit()
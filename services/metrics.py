@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import threading
+
+# Minimal Prometheus-style registry (counters, gauges, histograms) rendered in the text exposition format.
+# Each gunicorn worker keeps its own values; with METRICS_DIR set, workers flush them there and /metrics
+# adds them up, so a scrape sees the whole container and not just the worker that answered it.
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+REQUEST_LOG = os.getenv('REQUEST_LOG', '1') == '1'
+# Counters and histograms of workers that already exited, folded together by the gunicorn master
+RETIRED_SNAPSHOT = 'metrics_retired.json'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def snapshot(self):
+        with self.lock:
+            values = [[list(key), value if not isinstance(value, list) else list(value)] for key, value in self.values.items()]
+        return {"type": self.type, "help": self.documentation, "labelnames": list(self.labelnames), "values": values}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            # [count per bucket..., +Inf count, sum]
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[len(self.buckets)] += 1
+            state[-1] += value
+
+    def snapshot(self):
+        data = super().snapshot()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.last_flush = 0
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, fn):
+        """`fn()` runs before each snapshot, to refresh gauges from state kept elsewhere."""
+        self.collectors.append(fn)
+
+    def snapshot(self):
+        for fn in self.collectors:
+            try:
+                fn()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def flush(self, force=False):
+        """Writes this worker's snapshot to METRICS_DIR (at most every METRICS_FLUSH_SECONDS)."""
+        now = time.monotonic()
+        if not METRICS_DIR or (not force and now - self.last_flush < METRICS_FLUSH_SECONDS):
+            return
+        self.last_flush = now
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            write_snapshot(os.path.join(METRICS_DIR, f"metrics_{os.getpid()}.json"), self.snapshot())
+        except OSError as e:
+            print(f"Error flushing metrics: {e}")
+
+
+def write_snapshot(path, snapshot):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(path + '.tmp', path)
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def without_gauges(snapshot):
+    return {name: data for name, data in snapshot.items() if data["type"] != 'gauge'}
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def retire_worker(pid):
+    """Folds the snapshot of an exited worker into RETIRED_SNAPSHOT and deletes its file.
+
+    Called from the gunicorn master (child_exit), one worker at a time. Counters and histograms keep
+    their totals; gauges are dropped, they described a process that no longer exists.
+    """
+    if not METRICS_DIR:
+        return
+    path = os.path.join(METRICS_DIR, f"metrics_{pid}.json")
+    snapshot = read_snapshot(path)
+    if snapshot is None:
+        return
+    retired_path = os.path.join(METRICS_DIR, RETIRED_SNAPSHOT)
+    merged = merge([without_gauges(snapshot), read_snapshot(retired_path) or {}])
+    try:
+        write_snapshot(retired_path, {
+            name: dict(data, values=[[list(key), value] for key, value in data["values"].items()])
+            for name, data in merged.items()
+        })
+        os.remove(path)
+    except OSError as e:
+        print(f"Error retiring metrics of worker {pid}: {e}")
+
+
+def load_snapshots():
+    """Own snapshot plus those flushed by the other workers and the retired ones.
+
+    Gauges of dead workers not retired yet (e.g. killed while the master was down) are dropped.
+    """
+    own = registry.snapshot()
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return [own]
+    snapshots = [own]
+    for filename in os.listdir(METRICS_DIR):
+        if filename == RETIRED_SNAPSHOT:
+            snapshot = read_snapshot(os.path.join(METRICS_DIR, filename))
+            if snapshot:
+                snapshots.append(snapshot)
+            continue
+        pid = filename[len('metrics_'):-len('.json')]
+        if not filename.startswith('metrics_') or not filename.endswith('.json') or not pid.isdigit():
+            continue
+        pid = int(pid)
+        if pid == os.getpid():
+            continue
+        snapshot = read_snapshot(os.path.join(METRICS_DIR, filename))
+        if snapshot is None:
+            continue
+        if not pid_alive(pid):
+            snapshot = without_gauges(snapshot)
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, data in snapshot.items():
+            target = merged.setdefault(name, dict(data, values={}))
+            for labels, value in data["values"]:
+                key = tuple(labels)
+                current = target["values"].get(key)
+                if current is None:
+                    target["values"][key] = value
+                elif isinstance(value, list):
+                    target["values"][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target["values"][key] = current + value
+    return merged
+
+
+def format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render():
+    """Métricas de todos los workers en formato de exposición de Prometheus."""
+    lines = []
+    for name, data in sorted(merge(load_snapshots()).items()):
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['type']}")
+        labelnames = data["labelnames"]
+        for key, value in sorted(data["values"].items()):
+            if data["type"] != 'histogram':
+                lines.append(f"{name}{format_labels(labelnames, key)} {value}")
+                continue
+            buckets = data["buckets"]
+            for bound, count in zip(buckets, value):
+                lines.append(f"{name}_bucket{format_labels(labelnames, key, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{format_labels(labelnames, key, [('le', '+Inf')])} {value[len(buckets)]}")
+            lines.append(f"{name}_sum{format_labels(labelnames, key)} {value[-1]}")
+            lines.append(f"{name}_count{format_labels(labelnames, key)} {value[len(buckets)]}")
+    return '\n'.join(lines) + '\n'
+
+
+def log_request(payload):
+    """One JSON line per request with its timings."""
+    if REQUEST_LOG:
+        print(json.dumps(payload, ensure_ascii=False, default=str), flush=True)
+
+
+registry = Registry()
+
+# HTTP
+http_requests = registry.counter('http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status'))
+http_duration = registry.histogram('http_request_duration_seconds', 'HTTP request duration (streams: until the body is sent)', ('method', 'route'))
+
+# Chat pipeline
+chat_stage_duration = registry.histogram('chat_stage_duration_seconds', 'Duration of each /api/chat stage', ('stage',))
+chat_stage_failures = registry.counter('chat_stage_failures_total', 'Context stages dropped by timeout or error', ('stage', 'outcome'))
+chat_prompt_chars = registry.histogram('chat_prompt_chars', 'Characters sent to the LLM per chat turn', buckets=SIZE_BUCKETS + (256000, 512000))
+chat_prompt_tokens = registry.histogram('chat_prompt_tokens', 'Estimated prompt tokens per chat turn', buckets=SIZE_BUCKETS)
+chat_responses = registry.counter('chat_responses_total', 'Chat turns by outcome', ('outcome',))
+
+# LLM
+llm_duration = registry.histogram('llm_request_duration_seconds', 'LLM call latency per attempt (streams: until headers)', ('provider', 'outcome'))
+llm_requests = registry.counter('llm_requests_total', 'LLM call attempts', ('provider', 'outcome'))
+llm_tokens = registry.counter('llm_tokens_total', 'Tokens reported by the provider', ('kind',))
+llm_circuit_state = registry.gauge('llm_circuit_state', 'Circuit breaker state: 0 closed, 1 half open, 2 open', ('provider',))
+
+# Admission control
+admission_wait = registry.histogram('admission_wait_seconds', 'Time spent waiting in the admission queue')
+admission_rejected = registry.counter('admission_rejected_total', 'Requests rejected by admission control', ('reason',))
+admission_active = registry.gauge('admission_active_requests', 'Chat requests holding an admission slot')
+admission_queue_depth = registry.gauge('admission_queue_depth', 'Chat requests waiting for an admission slot')
+
+# Uploads and ingestion
+extraction_duration = registry.histogram('document_extraction_seconds', 'Text extraction time', ('source', 'file_type'))
+extraction_pages = registry.histogram('document_extraction_pages', 'Pages per extracted document', ('source', 'file_type'),
+                                      buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2000))
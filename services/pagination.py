@@ -0,0 +1,81 @@
+import os
+import base64
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+# Keyset (cursor) pagination over (timestamp, id): each page is an index range scan that starts at the
+# cursor, so page 100 costs the same as page 1 (unlike OFFSET) and rows inserted meanwhile do not shift pages.
+PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', '50'))
+PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', '200'))
+
+
+def encode_cursor(timestamp, row_id):
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(datetime, id) of an opaque cursor. Raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def page_params(args):
+    """limit, before and after from the query string. Raises ValueError on bad values."""
+    limit = int(args.get('limit', PAGE_SIZE_DEFAULT))
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    before, after = args.get('before'), args.get('after')
+    if before and after:
+        raise ValueError("Use either before or after, not both")
+    return (
+        min(limit, PAGE_SIZE_MAX),
+        decode_cursor(before) if before else None,
+        decode_cursor(after) if after else None,
+    )
+
+
+def keyset_page(query, time_column, id_column, limit, before=None, after=None):
+    """One page of `query`, newest first.
+
+    Without cursors it is the newest `limit` rows; `before` pages towards older rows and `after` towards
+    newer ones. Returns (rows, has_more), where has_more refers to the direction being paged. The rows
+    must expose the time and id columns under their own names (query the columns, not the entities).
+    """
+    if after:
+        timestamp, row_id = after
+        query = query.filter(or_(time_column > timestamp, and_(time_column == timestamp, id_column > row_id)))
+        query = query.order_by(time_column.asc(), id_column.asc())
+    else:
+        if before:
+            timestamp, row_id = before
+            query = query.filter(or_(time_column < timestamp, and_(time_column == timestamp, id_column < row_id)))
+        query = query.order_by(time_column.desc(), id_column.desc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after:
+        rows.reverse()
+    return rows, has_more
+
+
+def page_info(rows, time_key, limit, has_more):
+    """Cursors of both ends of a newest-first page: pass `before` to get older rows, `after` for newer.
+
+    An end row whose timestamp is NULL (not backfilled yet) has no cursor.
+    """
+    def cursor(row):
+        timestamp = getattr(row, time_key)
+        return encode_cursor(timestamp, row.id) if timestamp else None
+
+    return {
+        "limit": limit,
+        "hasMore": has_more,
+        "before": cursor(rows[-1]) if rows else None,
+        "after": cursor(rows[0]) if rows else None,
+    }
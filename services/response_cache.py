@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+import itertools
+from datetime import datetime, timedelta
+from sqlalchemy import update, delete
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import ResponseCache
+from services.retrieval import TOKEN_RE, normalize_text
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', '1') == '1'
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', str(24 * 3600)))
+RESPONSE_CACHE_MAX = int(os.getenv('RESPONSE_CACHE_MAX', '5000'))
+# Eviction (expired rows + COUNT for the size cap) runs once every N stores per worker, so the table
+# may exceed RESPONSE_CACHE_MAX by up to N rows per worker between runs
+RESPONSE_CACHE_EVICT_EVERY = max(1, int(os.getenv('RESPONSE_CACHE_EVICT_EVERY', '100')))
+
+_stores = itertools.count(1)
+
+
+def response_cache_key(message, model_name, kb_version, prompt_hash):
+    normalized = " ".join(TOKEN_RE.findall(normalize_text(message)))
+    raw = "\x1f".join([normalized, model_name, str(kb_version), prompt_hash])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def get_cached_response(cache_key):
+    entry = db.session.query(
+        ResponseCache.response_text, ResponseCache.status, ResponseCache.suggested_actions
+    ).filter(ResponseCache.cache_key == cache_key, ResponseCache.expires_at > datetime.utcnow()).first()
+    if not entry:
+        return None
+
+    db.session.execute(
+        update(ResponseCache).where(ResponseCache.cache_key == cache_key).values(hits=ResponseCache.hits + 1)
+    )
+    db.session.commit()
+    return {
+        "text": entry.response_text,
+        "status": entry.status,
+        "suggested_actions": json.loads(entry.suggested_actions or '[]')
+    }
+
+
+def store_response(cache_key, result):
+    now = datetime.utcnow()
+    try:
+        db.session.add(ResponseCache(
+            cache_key=cache_key,
+            response_text=result['text'],
+            status=result['status'],
+            suggested_actions=json.dumps(result.get('suggested_actions', []), ensure_ascii=False),
+            created_at=now,
+            expires_at=now + timedelta(seconds=RESPONSE_CACHE_TTL)
+        ))
+        db.session.commit()
+    except IntegrityError:
+        # Another worker stored the same answer first
+        db.session.rollback()
+        return
+    if next(_stores) % RESPONSE_CACHE_EVICT_EVERY == 0:
+        evict_responses()
+
+
+def evict_responses():
+    db.session.execute(delete(ResponseCache).where(ResponseCache.expires_at <= datetime.utcnow()))
+    overflow = db.session.query(ResponseCache.id).count() - RESPONSE_CACHE_MAX
+    if overflow > 0:
+        # Oldest entries go first (MySQL can't DELETE ... IN (SELECT ... LIMIT))
+        oldest = [row.id for row in db.session.query(ResponseCache.id).order_by(ResponseCache.created_at.asc()).limit(overflow)]
+        db.session.execute(delete(ResponseCache).where(ResponseCache.id.in_(oldest)))
+    db.session.commit()
+
+
+def purge_responses():
+    deleted = db.session.execute(delete(ResponseCache)).rowcount
+    db.session.commit()
+    return deleted
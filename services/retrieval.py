@@ -0,0 +1,125 @@
+import re
+import math
+import unicodedata
+from collections import Counter
+
+# Palabras vacías en español que no aportan a la búsqueda léxica
+STOPWORDS = {
+    'a', 'al', 'ante', 'bajo', 'con', 'contra', 'de', 'del', 'desde', 'durante', 'en', 'entre',
+    'hacia', 'hasta', 'mediante', 'para', 'por', 'segun', 'sin', 'sobre', 'tras',
+    'el', 'la', 'los', 'las', 'lo', 'un', 'una', 'unos', 'unas',
+    'y', 'e', 'o', 'u', 'ni', 'que', 'como', 'cual', 'cuales', 'cuando', 'donde', 'quien',
+    'se', 'su', 'sus', 'le', 'les', 'me', 'mi', 'mis', 'te', 'tu', 'tus', 'nos', 'yo',
+    'es', 'son', 'ser', 'fue', 'era', 'esta', 'este', 'esto', 'estos', 'estas', 'ese', 'esa',
+    'eso', 'esos', 'esas', 'hay', 'ha', 'han', 'he', 'muy', 'mas', 'pero', 'si', 'no', 'ya',
+    'tambien', 'porque', 'otro', 'otra', 'otros', 'otras', 'cada', 'todo', 'toda', 'todos', 'todas',
+}
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = 64
+
+
+def normalize_text(text):
+    """Minúsculas y sin tildes para que 'Liquidación' y 'liquidacion' coincidan."""
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [
+        t[:MAX_TERM_LENGTH] for t in TOKEN_RE.findall(normalize_text(text))
+        if len(t) > 1 and t not in STOPWORDS
+    ]
+
+
+def estimate_tokens(text):
+    # Aproximación estándar: ~4 caracteres por token
+    return len(text or '') // 4 + 1
+
+
+def split_passages(text, max_chars=1500, overlap=200):
+    """Divide un texto en pasajes de tamaño acotado respetando párrafos cuando es posible."""
+    paragraphs = [p.strip() for p in re.split(r'\n\s*\n', text or '') if p.strip()]
+
+    pieces = []
+    for para in paragraphs:
+        if len(para) <= max_chars:
+            pieces.append(para)
+            continue
+        # Párrafo demasiado largo: cortar con solapamiento
+        start = 0
+        while start < len(para):
+            end = min(start + max_chars, len(para))
+            if end < len(para):
+                cut = para.rfind(' ', start + max_chars // 2, end)
+                if cut > start:
+                    end = cut
+            pieces.append(para[start:end].strip())
+            if end >= len(para):
+                break
+            start = max(end - overlap, start + 1)
+
+    passages = []
+    current = []
+    current_len = 0
+    for piece in pieces:
+        if current and current_len + len(piece) + 2 > max_chars:
+            passages.append('\n\n'.join(current))
+            current = []
+            current_len = 0
+        current.append(piece)
+        current_len += len(piece) + 2
+    if current:
+        passages.append('\n\n'.join(current))
+    return passages
+
+
+def passage_terms(text, max_chars=1500):
+    """[(posición, pasaje, Counter de términos)] de los pasajes con algún término indexable."""
+    passages = []
+    for position, passage in enumerate(split_passages(text, max_chars=max_chars)):
+        terms = Counter(tokenize(passage))
+        if terms:
+            passages.append((position, passage, terms))
+    return passages
+
+
+def bm25_score(tf, df, n_docs, doc_len, avg_len, k1=1.5, b=0.75):
+    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+    norm = k1 * (1 - b + b * doc_len / (avg_len or 1))
+    return idf * tf * (k1 + 1) / (tf + norm)
+
+
+class PassageIndex:
+    """Índice BM25 en memoria sobre los pasajes de un único documento."""
+
+    def __init__(self, text, max_chars=1200):
+        self.passages = split_passages(text, max_chars=max_chars)
+        self.term_freqs = [Counter(tokenize(p)) for p in self.passages]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_len = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        self.df = Counter(term for tf in self.term_freqs for term in tf)
+
+    def search(self, query, token_budget):
+        """Pasajes más relevantes dentro del presupuesto, devueltos en orden de aparición como (posición, texto)."""
+        terms = set(tokenize(query))
+        n_docs = len(self.passages)
+        scores = []
+        for position, tf in enumerate(self.term_freqs):
+            score = sum(
+                bm25_score(tf[t], self.df[t], n_docs, self.lengths[position], self.avg_len)
+                for t in terms if t in tf
+            )
+            scores.append((score, position))
+
+        # Best scores first; ties (e.g. no matching terms) keep document order
+        ranked = sorted(scores, key=lambda s: (-s[0], s[1]))
+        selected = []
+        used_tokens = 0
+        for score, position in ranked:
+            tokens = estimate_tokens(self.passages[position])
+            if used_tokens + tokens > token_budget:
+                continue
+            used_tokens += tokens
+            selected.append(position)
+        return [(position, self.passages[position]) for position in sorted(selected)]
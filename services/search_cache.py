@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from services.retrieval import TOKEN_RE, normalize_text
+
+SEARCH_CACHE_BACKEND = os.getenv('SEARCH_CACHE_BACKEND', 'memory') # memory | sqlite
+SEARCH_CACHE_PATH = os.getenv('SEARCH_CACHE_PATH', os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'search_cache.db'))
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', str(6 * 3600)))
+SEARCH_CACHE_MAX = int(os.getenv('SEARCH_CACHE_MAX', '1000'))
+# How long a follower waits for an identical in-flight search before giving up
+SEARCH_COALESCE_TIMEOUT = float(os.getenv('SEARCH_COALESCE_TIMEOUT', '15'))
+
+
+def normalize_query(query):
+    """'¿Ley 820  Arrendamiento?' y 'ley 820 arrendamiento' comparten la misma entrada."""
+    return " ".join(TOKEN_RE.findall(normalize_text(query)))
+
+
+class MemoryBackend:
+    """LRU en memoria con expiración por TTL. Solo se comparte dentro del proceso."""
+
+    def __init__(self, max_entries=SEARCH_CACHE_MAX):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """LRU con TTL en un archivo SQLite, compartido por todos los workers de la máquina."""
+
+    def __init__(self, path=SEARCH_CACHE_PATH, max_entries=SEARCH_CACHE_MAX):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_search_cache_last_access ON search_cache (last_access)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires_at FROM search_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE search_cache SET last_access = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl, now)
+            )
+            conn.execute("DELETE FROM search_cache WHERE expires_at < ?", (now,))
+            conn.execute(
+                "DELETE FROM search_cache WHERE key IN ("
+                " SELECT key FROM search_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM search_cache")
+
+
+class SearchCache:
+    """Caché de resultados de búsqueda con coalescencia de búsquedas idénticas en curso."""
+
+    def __init__(self, backend, ttl=SEARCH_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_or_fetch(self, query, fetch):
+        key = normalize_query(query)
+        value = self.backend.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            return future.result(timeout=SEARCH_COALESCE_TIMEOUT)
+
+        try:
+            value = fetch(query)
+            # Errors (e.g. DDGS rate limiting) are not cached, only real answers
+            self.backend.set(key, value, self.ttl)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+def create_backend(name=SEARCH_CACHE_BACKEND):
+    if name == 'sqlite':
+        return SQLiteBackend()
+    return MemoryBackend()
+
+
+search_cache = SearchCache(create_backend())
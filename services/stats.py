@@ -0,0 +1,116 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import update, delete, func
+from extensions import db
+from models import StatCounter, ActivityBucket, User, Conversation, Message
+
+# Dashboard statistics maintained incrementally: the write paths bump counters and hourly activity buckets in
+# their own transaction, and /api/admin/stats only reads a handful of rows. reconcile() recounts from the
+# source tables to fix any drift (bulk imports, manual SQL, failed writes); run reconcile_stats.py from cron.
+STATS_WINDOW_HOURS = int(os.getenv('STATS_WINDOW_HOURS', '48')) # Buckets kept and rebuilt by reconcile()
+
+USERS = 'users'
+CONVERSATIONS = 'conversations'
+RISK_CASES = 'risk_cases'
+COUNTERS = (USERS, CONVERSATIONS, RISK_CASES)
+
+
+def upsert_add(model, keys, column, amount):
+    """INSERT the row or add `amount` to `column`, atomically (no lost updates between workers)."""
+    table = model.__table__
+    values = dict(keys, **{column: amount})
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_duplicate_key_update({column: table.c[column] + stmt.inserted[column]})
+    elif dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(index_elements=list(keys), set_={column: table.c[column] + stmt.excluded[column]})
+    else:
+        result = db.session.execute(
+            update(table).where(*(table.c[k] == v for k, v in keys.items())).values({column: table.c[column] + amount})
+        )
+        if result.rowcount:
+            return
+        stmt = table.insert().values(**values)
+    db.session.execute(stmt)
+
+
+def increment(name, amount=1):
+    """Adds to a dashboard counter. The caller commits, so the counter changes with the row it counts."""
+    upsert_add(StatCounter, {"name": name}, 'value', amount)
+
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def record_activity(user_id, messages=1, moment=None):
+    """Counts chat messages in the user's bucket for the current hour. The caller commits."""
+    upsert_add(ActivityBucket, {"hour": hour_bucket(moment or datetime.utcnow()), "user_id": user_id or 0},
+               'messages', messages)
+
+
+def get_dashboard_stats():
+    counters = dict(db.session.query(StatCounter.name, StatCounter.value).filter(StatCounter.name.in_(COUNTERS)))
+    if len(counters) < len(COUNTERS):
+        # Fresh database or counters never populated
+        reconcile()
+        counters = dict(db.session.query(StatCounter.name, StatCounter.value).filter(StatCounter.name.in_(COUNTERS)))
+
+    # Hour granularity: the window starts at the beginning of the hour 24h ago
+    since = hour_bucket(datetime.utcnow() - timedelta(hours=24))
+    active_users, messages = db.session.query(
+        func.count(func.distinct(func.nullif(ActivityBucket.user_id, 0))), func.coalesce(func.sum(ActivityBucket.messages), 0)
+    ).filter(ActivityBucket.hour >= since).one()
+    return {
+        "totalUsers": int(counters.get(USERS, 0)),
+        "totalConversations": int(counters.get(CONVERSATIONS, 0)),
+        "activeUsers24h": active_users,
+        "messages24h": int(messages),
+        "riskCases": int(counters.get(RISK_CASES, 0)),
+    }
+
+
+def set_counter(name, value):
+    result = db.session.execute(update(StatCounter).where(StatCounter.name == name).values(value=value))
+    if result.rowcount == 0:
+        db.session.add(StatCounter(name=name, value=value))
+
+
+def reconcile():
+    """Recounts the counters and rebuilds the last STATS_WINDOW_HOURS of buckets from the source tables.
+
+    Writes that land while it runs may be counted twice or missed; the next run corrects them.
+    Returns the differences found, {counter: recounted - stored}.
+    """
+    actual = {
+        USERS: db.session.query(func.count(User.id)).scalar(),
+        CONVERSATIONS: db.session.query(func.count(Conversation.id)).scalar(),
+        RISK_CASES: db.session.query(func.count(Conversation.id)).filter(Conversation.status == 'risk_detected').scalar(),
+    }
+    stored = dict(db.session.query(StatCounter.name, StatCounter.value).filter(StatCounter.name.in_(COUNTERS)))
+    drift = {name: value - stored.get(name, 0) for name, value in actual.items() if value != stored.get(name)}
+    for name, value in actual.items():
+        set_counter(name, value)
+
+    since = hour_bucket(datetime.utcnow() - timedelta(hours=STATS_WINDOW_HOURS))
+    buckets = {}
+    rows = db.session.query(Message.created_at, Conversation.user_id).join(
+        Conversation, Conversation.id == Message.conversation_id).filter(Message.created_at >= since)
+    for created_at, user_id in rows.yield_per(5000):
+        key = (hour_bucket(created_at), user_id or 0)
+        buckets[key] = buckets.get(key, 0) + 1
+    # Buckets older than the window are expired, the rest is replaced by the recount
+    db.session.execute(delete(ActivityBucket))
+    if buckets:
+        db.session.execute(ActivityBucket.__table__.insert(), [
+            {"hour": hour, "user_id": user_id, "messages": messages} for (hour, user_id), messages in buckets.items()
+        ])
+    db.session.commit()
+    return drift